@@ -10,7 +10,7 @@ class Arena():
     An Arena class where any 2 agents can be pit against each other.
     """
 
-    def __init__(self, player1, player2, game, display=None):
+    def __init__(self, player1, player2, game, display=None, searchStats=None, statsPerMove=False):
         """
         Input:
             player 1,2: two functions that takes board as input, return action
@@ -18,6 +18,10 @@ class Arena():
             display: a function that takes board as input and prints it (e.g.
                      display in othello/OthelloGame). Is necessary for verbose
                      mode.
+            searchStats: optional dict of name -> MCTS whose stats() are logged
+                         (and then reset) after every game.
+            statsPerMove: if True, the searchStats are also logged after every
+                          move.
 
         see othello/OthelloPlayers.py for an example. See pit.py for pitting
         human players/other baselines with each other.
@@ -26,6 +30,14 @@ class Arena():
         self.player2 = player2
         self.game = game
         self.display = display
+        self.searchStats = searchStats or {}
+        self.statsPerMove = statsPerMove
+
+    def logSearchStats(self, reset):
+        for name, mcts in self.searchStats.items():
+            log.info(f"[{name}] {mcts.formatStats(mcts.stats())}")
+            if reset:
+                mcts.resetStats()
 
     def playGame(self, verbose=False):
         """
@@ -61,8 +73,11 @@ class Arena():
                 log.debug(f'valids = {valids}')
                 assert valids[action] > 0
             board, curPlayer = self.game.getNextState(board, curPlayer, action, verbose=verbose)
+            if self.statsPerMove:
+                self.logSearchStats(reset=False)
             if verbose:
                 board.display()
+        self.logSearchStats(reset=True)
         if verbose:
             assert self.display
             print("Game over: Turn ", str(it), "Result ", str(self.game.getGameEnded(board, 1)))
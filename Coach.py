@@ -1,8 +1,13 @@
 import logging
 import os
+import random
+import socket
 import sys
 import time
+import multiprocessing as mp
+import queue
 from collections import deque
+from contextlib import nullcontext
 from pickle import Pickler, Unpickler
 from random import shuffle
 
@@ -10,7 +15,14 @@ import numpy as np
 from tqdm import tqdm
 
 from Arena import Arena
-from MCTS import MCTS
+from GameRecord import GameRecord, readRecords, writeRecords
+from MCTS import MCTS, OpeningCache
+from ParallelMCTS import RootParallelMCTS
+from Metrics import metrics
+from Profiler import PhaseProfiler
+from RemoteSelfPlay import Coordinator
+from SharedWeights import SharedWeights
+from utils import atomicWrite, dotdict, writer
 
 log = logging.getLogger(__name__)
 
@@ -24,11 +36,28 @@ class Coach():
     def __init__(self, game, nnet, args):
         self.game = game
         self.nnet = nnet
-        self.pnet = self.nnet.__class__(self.game)  # the competitor network
+        self._pnet = None  # the competitor network, only built when an arena needs it
         self.args = args
-        self.mcts = MCTS(self.game, self.nnet, self.args)
+        # search-time pruning of duck placements must never shape the training targets
+        self.selfPlayArgs = dotdict({**self.args, 'duckCandidates': None})
+        # search of the first plies, shared by the self-play episodes of one network version
+        self.openingCache = OpeningCache(self.args.openingPlies) if self.args.get('openingPlies') else None
+        self.mcts = MCTS(self.game, self.nnet, self.selfPlayArgs, self.openingCache)
         self.trainExamplesHistory = []  # history of examples from args.numItersForTrainExamplesHistory latest iterations
         self.skipFirstSelfPlay = False  # can be overriden in loadTrainExamples()
+        self.resignStats = {'resigned': 0, 'checked': 0, 'false': 0}  # resignation counts for the current iteration
+        self.sharedWeights = None  # the network's weights as seen by the self-play workers
+        self.workers = []  # (process, connection) of each self-play worker
+        self.coordinator = None  # hands out self-play games to remote workers
+        self.record = None  # GameRecord of the latest executeEpisode()
+        self.iterationRecords = None  # GameRecords of the current iteration's self-play, until saved
+        metrics.enabled = bool(self.args.get('metricsFormat'))
+
+    @property
+    def pnet(self):
+        if self._pnet is None:
+            self._pnet = self.nnet.__class__(self.game)
+        return self._pnet
 
     def executeEpisode(self):
         """
@@ -41,15 +70,37 @@ class Coach():
         It uses a temp=1 if episodeStep < tempThreshold, and thereafter
         uses temp=0.
 
+        With args.playoutCapRandomization, only a fraction args.fullSearchProb
+        of the moves get the full numMCTSSims search and a policy target. The
+        rest are played after a cheap search of numMCTSSimsFast simulations
+        and are recorded with pi=None, so they only train the value head.
+
+        With args.resignThreshold set, a player whose root value stays below
+        the threshold for resignConsecutive of their moves in a row resigns
+        and loses. In a fraction resignPlayoutFraction of the games nobody
+        resigns; those games are played out to count false resignations.
+
+        With args.gumbel, moves are chosen by MCTS.gumbelSearch and pi is its
+        improved policy rather than the visit count distribution.
+
+        The game is also recorded in self.record, a GameRecord keeping the
+        args.recordTopK most probable entries of each policy target.
+
         Returns:
             trainExamples: a list of examples of the form (canonicalBoard, currPlayer, pi,v)
-                           pi is the MCTS informed policy vector, v is +1 if
+                           pi is the MCTS informed policy vector (or None), v is +1 if
                            the player eventually won the game, else -1.
         """
         trainExamples = []
         board = self.game.getInitBoard()
         self.curPlayer = 1
         episodeStep = 0
+        self.record = GameRecord()
+
+        resignThreshold = self.args.get('resignThreshold')
+        canResign = resignThreshold is not None and random.random() >= self.args.get('resignPlayoutFraction', 0.1)
+        lowValueMoves = {1: 0, -1: 0}  # consecutive moves each player spent below resignThreshold
+        wouldHaveResigned = None  # in play-out games, the first player that would have resigned
 
         while True:
             episodeStep += 1
@@ -63,17 +114,57 @@ class Coach():
 
             temp = int(episodeStep < self.args.tempThreshold)
 
-            pi = self.mcts.getActionProb(canonicalBoard, temp=temp)
-            sym = self.game.getSymmetries(canonicalBoard, pi)
-            for b, p in sym:
-                trainExamples.append([b.encode(), self.curPlayer, p, None])
+            fullSearch = True
+            if self.args.get('playoutCapRandomization'):
+                fullSearch = random.random() < self.args.get('fullSearchProb', 0.25)
+            numSims = None if fullSearch else self.args.get('numMCTSSimsFast', 6)
+
+            if self.args.get('gumbel'):
+                # the Gumbel noise already explores, so play the searched move and train on the improved policy
+                action, pi = self.mcts.gumbelSearch(canonicalBoard, numSims)
+            else:
+                pi = self.mcts.getActionProb(canonicalBoard, temp=temp, numSims=numSims)
+                action = np.random.choice(len(pi), p=pi)
+            if self.args.get('searchStatsLog') == 'move':
+                log.info(f"Search stats: {MCTS.formatStats(self.mcts.stats())}")
+            with metrics.timer('selfplay.encode'):
+                sym = self.game.getSymmetries(canonicalBoard, pi)
+                for b, p in sym:
+                    trainExamples.append([b.encode(), self.curPlayer, p if fullSearch else None, None])
+            self.record.add(action, pi if fullSearch else None, self.args.get('recordTopK'))
+            metrics.incr('selfplay.moves')
+            metrics.incr('selfplay.full_search_moves' if fullSearch else 'selfplay.fast_search_moves')
+
+            if resignThreshold is not None:
+                if self.mcts.getRootValue(canonicalBoard) < resignThreshold:
+                    lowValueMoves[self.curPlayer] += 1
+                else:
+                    lowValueMoves[self.curPlayer] = 0
+                if lowValueMoves[self.curPlayer] >= self.args.get('resignConsecutive', 3):
+                    if canResign:
+                        if self.args.verbose:
+                            log.info(f"Player {self.curPlayer} resigns after {episodeStep} moves")
+                        self.resignStats['resigned'] += 1
+                        metrics.incr('selfplay.resignations')
+                        r = -1
+                        self.record.result = r * self.curPlayer
+                        return [(x[0], x[2], r * ((-1) ** (x[1] != self.curPlayer))) for x in trainExamples]
+                    if wouldHaveResigned is None:
+                        wouldHaveResigned = self.curPlayer
 
-            action = np.random.choice(len(pi), p=pi)
             board, self.curPlayer = self.game.getNextState(board, self.curPlayer, action, verbose=self.args.verbose)
 
             r = self.game.getGameEnded(board, self.curPlayer, verbose=self.args.verbose)
 
             if r != 0:
+                if wouldHaveResigned is not None:
+                    # r is from the perspective of curPlayer; anything better than a loss
+                    # for the player that wanted to resign means resigning would have been wrong
+                    resignerResult = r if wouldHaveResigned == self.curPlayer else -r
+                    self.resignStats['checked'] += 1
+                    if resignerResult > -1:
+                        self.resignStats['false'] += 1
+                self.record.result = r * self.curPlayer
                 return [(x[0], x[2], r * ((-1) ** (x[1] != self.curPlayer))) for x in trainExamples]
 
     def learn(self):
@@ -83,21 +174,42 @@ class Coach():
         examples in trainExamples (which has a maximum length of maxlenofQueue).
         It then pits the new neural network against the old one and accepts it
         only if it wins >= updateThreshold fraction of games.
-        """
 
+        The self-play workers and the coordinator are stopped at the end,
+        also when an iteration fails.
+        """
+        try:
+            self.learnIterations()
+        finally:
+            self.stopWorkers()
+        writer.wait()  # raise if the last checkpoint or examples failed to write
+
+    def learnIterations(self):
+        # the iterations of learn()
         for i in range(self.args.starting_iteration, self.args.numIters + 1):
             # bookkeeping
             log.info(f'Starting Iter #{i} ...')
             # examples of the iteration
             if not self.skipFirstSelfPlay or i > 1:
                 iterationTrainExamples = deque([], maxlen=self.args.maxlenOfQueue)
+                self.iterationRecords = []
 
-                for _ in tqdm(range(self.args.numEps), desc="Self Play"):
-                    self.mcts = MCTS(self.game, self.nnet, self.args)  # reset search tree
-                    episode_start_time = time.time()
-                    iterationTrainExamples += self.executeEpisode()
-                    episode_end_time = time.time()
-                    log.info(f"Game done in {round((episode_end_time - episode_start_time) * 1000)}ms")
+                if self.args.get('coordinatorPort') is not None:
+                    games = self.remoteSelfPlay(self.args.numEps)
+                elif self.args.get('selfPlayWorkers', 0) > 1:
+                    games = self.parallelSelfPlay(self.args.numEps)
+                else:
+                    games = (self.playEpisode() for _ in tqdm(range(self.args.numEps), desc="Self Play"))
+                for episodeExamples, seconds, searchStats, record in games:
+                    iterationTrainExamples += episodeExamples
+                    self.iterationRecords.append(record)
+                    metrics.add('selfplay.episode', seconds)
+                    metrics.incr('selfplay.examples', len(episodeExamples))
+                    log.info(f"Game done in {round(seconds * 1000)}ms")
+                    if self.args.get('searchStatsLog'):
+                        log.info(f"Search stats: {MCTS.formatStats(searchStats)}")
+
+                self.logResignStats()
 
                 # save the iteration examples to the history 
                 self.trainExamplesHistory.append(iterationTrainExamples)
@@ -122,15 +234,24 @@ class Coach():
                 # training new network, keeping a copy of the old one
                 self.nnet.save_checkpoint(folder=self.args.checkpoint, filename='temp.pth.tar')
                 self.pnet.load_checkpoint(folder=self.args.checkpoint, filename='temp.pth.tar')
-                pmcts = MCTS(self.game, self.pnet, self.args)
-
-                self.nnet.train(trainExamples)
-                nmcts = MCTS(self.game, self.nnet, self.args)
-
-                log.info('PITTING AGAINST PREVIOUS VERSION')
-                arena = Arena(lambda x: np.argmax(pmcts.getActionProb(x, temp=0)),
-                            lambda x: np.argmax(nmcts.getActionProb(x, temp=0)), self.game)
-                pwins, nwins, draws = arena.playGames(self.args.arenaCompare)
+                with metrics.timer('train.total'):
+                    self.nnet.train(trainExamples)
+
+                # arena games may search root-parallel; self-play parallelises across episodes instead
+                arenaMCTS = RootParallelMCTS if self.args.get('numProcesses', 1) > 1 else MCTS
+                pmcts = arenaMCTS(self.game, self.pnet, self.args)
+                nmcts = arenaMCTS(self.game, self.nnet, self.args)
+                try:
+                    log.info('PITTING AGAINST PREVIOUS VERSION')
+                    searchStats = {'prev': pmcts, 'new': nmcts} if self.args.get('searchStatsLog') else None
+                    arena = Arena(lambda x: np.argmax(pmcts.getActionProb(x, temp=0)),
+                                lambda x: np.argmax(nmcts.getActionProb(x, temp=0)), self.game,
+                                searchStats=searchStats, statsPerMove=self.args.get('searchStatsLog') == 'move')
+                    pwins, nwins, draws = arena.playGames(self.args.arenaCompare)
+                finally:
+                    if arenaMCTS is RootParallelMCTS:
+                        pmcts.close()  # stops the worker processes
+                        nmcts.close()
 
                 log.info('NEW/PREV WINS : %d / %d ; DRAWS : %d' % (nwins, pwins, draws))
                 if pwins + nwins == 0 or float(nwins) / (pwins + nwins) < self.args.updateThreshold:
@@ -140,29 +261,299 @@ class Coach():
                     log.info('ACCEPTING NEW MODEL')
                     self.nnet.save_checkpoint(folder=self.args.checkpoint, filename=self.getCheckpointFile(i))
                     self.nnet.save_checkpoint(folder=self.args.checkpoint, filename='best.pth.tar')
+                    if self.openingCache is not None:
+                        self.openingCache.reset(version=i)
             else:
-                self.nnet.train(trainExamples)
+                with metrics.timer('train.total'):
+                    self.nnet.train(trainExamples)
                 log.info(f'SAVING CHECKPOINT: {self.getCheckpointFile(i)}')
                 self.nnet.save_checkpoint(folder=self.args.checkpoint, filename=self.getCheckpointFile(i))
+                if self.openingCache is not None:
+                    self.openingCache.reset(version=i)
 
+            self.saveMetrics(i)
+
+    def learnContinuous(self):
+        """
+        Runs self-play and training concurrently instead of alternating them.
+        max(1, args.selfPlayWorkers) producer processes play games with the
+        latest checkpoint and write them as shards of GameRecords into
+        <checkpoint>/shards (see _producer), picking up every new checkpoint
+        between games.
+
+        Meanwhile this process replays new shards into a window of the
+        args.maxlenOfQueue latest examples, and moves each consumed shard to
+        <checkpoint>/shards/consumed, so a restart only reads fresh games.
+        Whenever args.trainEvery new examples have arrived it trains on
+        args.sampleReuse samples per new example, drawn from the window, and
+        publishes the result as latest.pth.tar. A numbered checkpoint is kept
+        every args.checkpointEvery rounds. Runs rounds starting_iteration to
+        numIters. The producers' resignation counts and metrics are reported
+        with every round.
+        """
+        shardFolder = os.path.join(self.args.checkpoint, 'shards')
+        consumedFolder = os.path.join(shardFolder, 'consumed')
+        os.makedirs(consumedFolder, exist_ok=True)
+        self.nnet.save_checkpoint(folder=self.args.checkpoint, filename='latest.pth.tar').result()
+
+        stop = mp.Event()
+        producerStats = mp.Queue()  # (resignStats, metrics snapshot) per shard written
+        producers = []
+        for rank in range(max(1, self.args.get('selfPlayWorkers', 0))):
+            producer = mp.Process(target=_producer, daemon=True,
+                                  args=(rank, self.game, self.nnet.__class__, self.args, stop, producerStats,
+                                        random.randrange(2 ** 31)))
+            producer.start()
+            producers.append(producer)
+
+        window = deque([], maxlen=self.args.maxlenOfQueue)
+        for e in self.trainExamplesHistory:
+            window.extend(e)
+        trainEvery = self.args.get('trainEvery', 2048)
+        sampleReuse = self.args.get('sampleReuse', 4)
+        checkpointEvery = self.args.get('checkpointEvery', 10)
+        try:
+            for i in range(self.args.starting_iteration, self.args.numIters + 1):
+                log.info(f'Waiting for {trainEvery} new examples for round #{i} ...')
+                new = 0
+                games = 0
+                while new < trainEvery:
+                    self.collectProducerStats(producerStats)
+                    shards = sorted(f for f in os.listdir(shardFolder) if f.endswith('.records'))
+                    if not shards:
+                        if not any(p.is_alive() for p in producers):
+                            raise RuntimeError("All self-play producers have exited")
+                        time.sleep(1)
+                        continue
+                    for name in shards:
+                        for record in readRecords(os.path.join(shardFolder, name)):
+                            with metrics.timer('selfplay.replay'):
+                                examples = record.examples(self.game)
+                            window.extend(examples)
+                            new += len(examples)
+                            games += 1
+                            metrics.incr('selfplay.examples', len(examples))
+                        os.replace(os.path.join(shardFolder, name), os.path.join(consumedFolder, name))
+                self.collectProducerStats(producerStats)
+                self.logResignStats(games)
+
+                samples = int(new * sampleReuse)
+                log.info(f'Round #{i}: training on {samples} samples of {len(window)} examples ({new} new)')
+                with metrics.timer('train.total'):
+                    self.nnet.train(list(window), samples=samples)
+                self.nnet.save_checkpoint(folder=self.args.checkpoint, filename='latest.pth.tar')
+                if i % checkpointEvery == 0:
+                    log.info(f'SAVING CHECKPOINT: {self.getCheckpointFile(i)}')
+                    self.nnet.save_checkpoint(folder=self.args.checkpoint, filename=self.getCheckpointFile(i))
+                self.saveMetrics(i)
+        finally:
+            stop.set()
+            for producer in producers:
+                producer.join()
+        writer.wait()
+
+    def collectProducerStats(self, producerStats):
+        # adds up the resignation counts and metrics the producers of learnContinuous sent so far
+        while True:
+            try:
+                resignStats, snapshot = producerStats.get_nowait()
+            except queue.Empty:
+                return
+            for key, n in resignStats.items():
+                self.resignStats[key] += n
+            metrics.merge(snapshot)
+
+    def playEpisode(self):
+        """
+        Plays one self-play episode with a fresh search tree.
+
+        Returns:
+            (examples, seconds, searchStats, record): the episode's training
+            examples, its duration, the search's stats() and its GameRecord
+        """
+        self.mcts = MCTS(self.game, self.nnet, self.selfPlayArgs, self.openingCache)  # reset search tree
+        start = time.time()
+        examples = self.executeEpisode()
+        return examples, time.time() - start, self.mcts.stats(), self.record
+
+    def parallelSelfPlay(self, numEps):
+        """
+        Plays numEps self-play episodes split over args.selfPlayWorkers
+        worker processes. The workers are started once and use the network's
+        weights from shared memory (see SharedWeights); every call publishes
+        the current weights, which the workers switch to before their next game.
+
+        Returns:
+            a list with the playEpisode() result of every episode
+        """
+        if self.sharedWeights is None:
+            self.sharedWeights = SharedWeights(self.nnet)
+            for k in range(self.args.selfPlayWorkers):
+                conn, child_conn = mp.Pipe()
+                worker = mp.Process(target=_selfPlayWorker, daemon=True,
+                                    args=(child_conn, self.game, self.nnet.__class__, self.sharedWeights, self.args,
+                                          random.randrange(2 ** 31)))
+                worker.start()
+                child_conn.close()
+                self.workers.append((worker, conn))
+        else:
+            self.sharedWeights.publish(self.nnet)
+
+        numWorkers = len(self.workers)
+        for k, (_, conn) in enumerate(self.workers):
+            conn.send(numEps // numWorkers + (1 if k < numEps % numWorkers else 0))
+        games = []
+        for _, conn in tqdm(self.workers, desc="Self Play (workers)"):
+            workerGames, resignStats, workerMetrics = conn.recv()
+            games += workerGames
+            metrics.merge(workerMetrics)
+            for key, n in resignStats.items():
+                self.resignStats[key] += n
+        return games
+
+    def remoteSelfPlay(self, numEps):
+        """
+        Has numEps self-play episodes played by remote workers connected to
+        a Coordinator on args.coordinatorPort (see RemoteSelfPlay), with the
+        current network. Workers are started with selfplay_worker.py. Games
+        the workers do not deliver within args.remoteWaitTimeout are played
+        here instead.
+
+        Returns:
+            a list with the playEpisode() result of every episode
+        """
+        if self.coordinator is None:
+            self.coordinator = Coordinator(self.game, self.args)
+        self.coordinator.publish(self.nnet)
+        games, resignStats = self.coordinator.playGames(numEps)
+        for key, n in resignStats.items():
+            self.resignStats[key] += n
+        if len(games) < numEps:
+            log.warning(f"Playing the remaining {numEps - len(games)} games locally")
+            games += [self.playEpisode() for _ in tqdm(range(numEps - len(games)), desc="Self Play")]
+        return games
+
+    def stopWorkers(self):
+        for worker, conn in self.workers:
+            try:
+                conn.send(None)
+            except OSError:
+                pass  # the worker has died already
+            worker.join()
+        self.workers = []
+        if self.coordinator is not None:
+            self.coordinator.close()
+            self.coordinator = None
+
+    def logResignStats(self, numGames=None):
+        """
+        Logs how many of the numGames games (args.numEps by default) of this
+        iteration ended by resignation, and the false resignation rate
+        measured on the games that were played out.
+        """
+        if self.args.get('resignThreshold') is None:
+            return
+        stats = self.resignStats
+        rate = stats['false'] / stats['checked'] if stats['checked'] else 0.0
+        log.info(f"Resignations: {stats['resigned']}/{numGames or self.args.numEps} games; "
+                 f"false resignation rate {rate:.1%} ({stats['false']}/{stats['checked']} played out)")
+        metrics.incr('selfplay.resign_checked', stats['checked'])
+        metrics.incr('selfplay.false_resignations', stats['false'])
+        self.resignStats = {'resigned': 0, 'checked': 0, 'false': 0}
+
+    def profile(self, numEps, phases=('selfplay', 'train')):
+        """
+        Profiles numEps episodes of self-play and one training epoch, instead
+        of running learn(). Only the phases listed in phases are profiled; the
+        others still run (training needs examples) but without instrumentation.
+        Profiles are written to the checkpoint folder, see Profiler.PhaseProfiler.
+        """
+        examples = []
+        if 'selfplay' in phases or not self.trainExamplesHistory:
+            profiler = PhaseProfiler(self.args.checkpoint, 'selfplay') if 'selfplay' in phases else nullcontext()
+            with profiler:
+                for _ in tqdm(range(numEps), desc="Self Play (profiling)"):
+                    examples += self.playEpisode()[0]
+        else:
+            for e in self.trainExamplesHistory:
+                examples.extend(e)
+
+        if 'train' in phases:
+            shuffle(examples)
+            with PhaseProfiler(self.args.checkpoint, 'train'):
+                self.nnet.train(examples, epochs=1)
+
+    def saveMetrics(self, iteration):
+        """
+        Writes the timings and counts collected during this iteration to the
+        checkpoint folder, then starts counting afresh for the next iteration.
+        Does nothing unless args.metricsFormat is 'json' or 'prometheus'.
+        """
+        fmt = self.args.get('metricsFormat')
+        if not fmt:
+            return
+        ext = 'prom' if fmt == 'prometheus' else 'json'
+        metrics.save(self.args.checkpoint, f'metrics_iter_{iteration}.{ext}', fmt=fmt,
+                     labels={'iteration': iteration, 'host': socket.gethostname()})
+        metrics.reset()
 
     def getCheckpointFile(self, iteration):
         return 'checkpoint_' + str(iteration) + '.pth.tar'
 
     def saveTrainExamples(self, iteration):
+        """
+        Saves the example history next to the checkpoint of iteration. With
+        args.recordGames, only this iteration's games are saved instead, as
+        an archive of GameRecords (see loadTrainExamples). Their policy
+        targets keep only args.recordTopK entries as float16, so training
+        after a resume differs from training on the in-memory history.
+        """
         folder = self.args.checkpoint
         if not os.path.exists(folder):
             os.makedirs(folder)
+        if self.args.get('recordGames'):
+            if self.iterationRecords is None:
+                return None  # no new games, the earlier archives already hold the history
+            filename = os.path.join(folder, self.getCheckpointFile(iteration) + ".records")
+            log.info(f"Saving {len(self.iterationRecords)} game records to {filename}")
+            records = self.iterationRecords
+            self.iterationRecords = None
+
+            def write(path):
+                with metrics.timer('examples.save'):
+                    writeRecords(path, records)
+            return writer.submit(filename, write)
         filename = os.path.join(folder, self.getCheckpointFile(iteration) + ".examples")
         log.info(f"Saving examples to {filename}")
-        with open(filename, "wb+") as f:
-            Pickler(f).dump(self.trainExamplesHistory)
-        f.closed
+        history = [list(e) for e in self.trainExamplesHistory]  # snapshot, the history keeps changing
+
+        def write(path):
+            with metrics.timer('examples.save'), open(path, "wb+") as f:
+                Pickler(f).dump(history)
+        return writer.submit(filename, write)
 
     def loadTrainExamples(self):
         modelFile = os.path.join(self.args.load_folder_file[0], self.args.load_folder_file[1])
         examplesFile = modelFile + ".examples"
-        if not os.path.isfile(examplesFile):
+        writer.wait()  # the examples may still be being written
+        if not os.path.isfile(examplesFile) and os.path.isfile(modelFile + ".records"):
+            # the archives of the iterations in the history window, the loaded model's last
+            last = self.args.starting_iteration - 1
+            archives = [os.path.join(self.args.load_folder_file[0], self.getCheckpointFile(k) + ".records")
+                        for k in range(last - self.args.numItersForTrainExamplesHistory + 1, last)]
+            archives = [f for f in archives if os.path.isfile(f)] + [modelFile + ".records"]
+            log.info(f"Replaying the game records of {len(archives)} iterations...")
+            log.warning(f"Game records keep policy targets as float16 (top {self.args.get('recordTopK')} entries), "
+                        f"so the resumed training examples are approximate")
+            self.trainExamplesHistory = []
+            for archive in archives:
+                examples = []
+                for record in readRecords(archive):
+                    examples += record.examples(self.game)
+                self.trainExamplesHistory.append(examples)
+            log.info('Loading done!')
+            self.skipFirstSelfPlay = True
+        elif not os.path.isfile(examplesFile):
             log.warning(f'File "{examplesFile}" with trainExamples not found!')
             r = input("Continue? [y|n]")
             if r != "y":
@@ -175,3 +566,62 @@ class Coach():
 
             # examples based on the model were already collected (loaded)
             self.skipFirstSelfPlay = True
+
+
+def _producer(rank, game, nnetClass, args, stop, producerStats, seed):
+    # Self-play producer process of Coach.learnContinuous: plays games with the
+    # latest checkpoint until stop is set, writing every args.shardGames games
+    # as one shard of GameRecords, and putting the shard's resignation counts
+    # and metrics on producerStats
+    random.seed(seed)
+    np.random.seed(seed)
+    producerStats.cancel_join_thread()  # don't hang on exit over stats nobody reads anymore
+    nnet = nnetClass(game)
+    coach = Coach(game, nnet, args)
+    checkpoint = os.path.join(args.checkpoint, 'latest.pth.tar')
+    shardFolder = os.path.join(args.checkpoint, 'shards')
+    loaded = None
+    seq = 0
+    records = []
+    while not stop.is_set():
+        mtime = os.path.getmtime(checkpoint)
+        if mtime != loaded:
+            nnet.load_checkpoint(args.checkpoint, 'latest.pth.tar')
+            loaded = mtime
+            if coach.openingCache is not None:
+                coach.openingCache.reset(mtime)
+        records.append(coach.playEpisode()[3])
+        if len(records) >= args.get('shardGames', 1):
+            shard = os.path.join(shardFolder, f'shard_{rank}_{os.getpid()}_{seq}.records')
+            atomicWrite(shard, lambda path: writeRecords(path, records))
+            producerStats.put((coach.resignStats, metrics.snapshot()))
+            coach.resignStats = {key: 0 for key in coach.resignStats}
+            metrics.reset()
+            seq += 1
+            records = []
+
+
+def _selfPlayWorker(conn, game, nnetClass, sharedWeights, args, seed):
+    # Self-play worker process of Coach.parallelSelfPlay: answers a number of
+    # episodes with their playEpisode() results, the resignation counts and
+    # the metrics collected while playing them
+    random.seed(seed)
+    np.random.seed(seed)
+    nnet = sharedWeights.attach(nnetClass, game)
+    coach = Coach(game, nnet, args)
+    while True:
+        numEps = conn.recv()
+        if numEps is None:
+            break
+        if sharedWeights.refresh(nnet) and coach.openingCache is not None:
+            coach.openingCache.reset(nnet.weightsVersion)
+        coach.resignStats = {key: 0 for key in coach.resignStats}
+        metrics.reset()
+        games = []
+        for _ in range(numEps):
+            examples, seconds, searchStats, record = coach.playEpisode()
+            # float32 arrays pickle far smaller than lists of floats
+            examples = [(b, None if pi is None else np.asarray(pi, dtype=np.float32), v) for b, pi, v in examples]
+            games.append((examples, seconds, searchStats, record))
+        conn.send((games, coach.resignStats, metrics.snapshot()))
+    conn.close()
@@ -72,6 +72,34 @@ class Game():
         """
         pass
 
+    def getWinningMoves(self, board, valids):
+        """
+        Input:
+            board: current board in its canonical form
+            valids: the vector returned by getValidMoves(board, 1)
+
+        Returns:
+            winningMoves: a list of valid actions that win the game on the spot.
+                          Used by the MCTS-solver to prove nodes at expansion;
+                          games that cannot tell cheaply may return [].
+        """
+        return []
+
+    def filterSearchActions(self, board, actions, priors, n):
+        """
+        Input:
+            board: current board in its canonical form
+            actions: the valid actions of board considered by the search
+            priors: the network's prior of each of them
+            n: game specific size of the subset to keep
+
+        Returns:
+            keep: a boolean mask over actions of the ones worth searching. Only
+                  used to narrow the search in play, never for self-play, so
+                  games without a cheap notion of equivalent moves keep all.
+        """
+        return [True] * len(actions)
+
     def getCanonicalForm(self, board, player):
         """
         Input:
@@ -0,0 +1,132 @@
+import struct
+
+import numpy as np
+
+_HEADER = struct.Struct('<4sIf')
+_MAGIC = b'GRC1'
+_NO_PI = 0xFFFF
+
+
+class GameRecord():
+    """
+    A self-play game as its moves rather than its positions: the action of
+    every ply, the top-k entries of the ply's policy target (None for plies
+    without one), and the result from the first player's perspective.
+
+    The binary form is a header, the actions as uint32, the number of policy
+    entries per ply as uint16, then the entries' actions (uint32) and
+    probabilities (float16). A 100 ply game takes a few KB, where its encoded
+    boards take megabytes. examples() replays the game into training examples.
+    """
+
+    def __init__(self, actions=None, policies=None, result=0.0):
+        self.actions = actions if actions is not None else []
+        self.policies = policies if policies is not None else []  # per ply (actions, probs) or None
+        self.result = result
+
+    def __len__(self):
+        return len(self.actions)
+
+    def add(self, action, pi, topK=None):
+        """
+        Records a ply: the action played and the policy target pi (or None),
+        of which only the topK most probable entries are kept (all nonzero
+        entries if topK is None).
+        """
+        self.actions.append(int(action))
+        if pi is None:
+            self.policies.append(None)
+            return
+        pi = np.asarray(pi, dtype=np.float32)
+        nonzero = np.flatnonzero(pi)
+        if topK is not None and len(nonzero) > topK:
+            nonzero = nonzero[np.argpartition(pi[nonzero], -topK)[-topK:]]
+        if len(nonzero) >= _NO_PI:
+            nonzero = nonzero[np.argsort(pi[nonzero])[-(_NO_PI - 1):]]
+        self.policies.append((nonzero.astype(np.uint32), pi[nonzero].astype(np.float16)))
+
+    def examples(self, game):
+        """
+        Replays the game from game.getInitBoard().
+
+        Returns:
+            examples: the (board, pi, v) training examples of the game, the same
+                      as Coach.executeEpisode() produced, except that policies
+                      hold only the recorded entries (renormalized)
+        """
+        examples = []
+        board = game.getInitBoard()
+        player = 1
+        actionSize = game.getActionSize()
+        for action, policy in zip(self.actions, self.policies):
+            canonicalBoard = game.getCanonicalForm(board, player)
+            pi = np.zeros(actionSize, dtype=np.float32)
+            if policy is not None:
+                pi[policy[0]] = policy[1]
+                pi /= pi.sum()
+            for b, p in game.getSymmetries(canonicalBoard, pi):
+                examples.append((b.encode(), p if policy is not None else None, self.result * player))
+            board, player = game.getNextState(board, player, action)
+        return examples
+
+    def toBytes(self):
+        ks = np.array([_NO_PI if p is None else len(p[0]) for p in self.policies], dtype=np.uint16)
+        policies = [p for p in self.policies if p is not None]
+        return b''.join([
+            _HEADER.pack(_MAGIC, len(self.actions), self.result),
+            np.array(self.actions, dtype=np.uint32).tobytes(),
+            ks.tobytes(),
+            *(a.tobytes() for a, _ in policies),
+            *(p.tobytes() for _, p in policies),
+        ])
+
+    @classmethod
+    def fromBytes(cls, data):
+        magic, n, result = _HEADER.unpack_from(data)
+        if magic != _MAGIC:
+            raise ValueError("Not a game record")
+        offset = _HEADER.size
+        actions = np.frombuffer(data, dtype=np.uint32, count=n, offset=offset)
+        offset += 4 * n
+        ks = np.frombuffer(data, dtype=np.uint16, count=n, offset=offset)
+        offset += 2 * n
+        total = int(ks[ks != _NO_PI].sum())
+        policyActions = np.frombuffer(data, dtype=np.uint32, count=total, offset=offset)
+        policyProbs = np.frombuffer(data, dtype=np.float16, count=total, offset=offset + 4 * total)
+        policies = []
+        start = 0
+        for k in ks:
+            if k == _NO_PI:
+                policies.append(None)
+                continue
+            policies.append((policyActions[start:start + k], policyProbs[start:start + k]))
+            start += k
+        return cls([int(a) for a in actions], policies, result)
+
+
+def writeRecords(path, records):
+    """
+    Writes records to path as an archive of length-prefixed GameRecords.
+    """
+    with open(path, 'wb') as f:
+        for record in records:
+            data = record.toBytes()
+            f.write(struct.pack('<I', len(data)))
+            f.write(data)
+
+
+def readRecords(path):
+    """
+    Returns:
+        records: the GameRecords of an archive written by writeRecords()
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    records = []
+    offset = 0
+    while offset < len(data):
+        length, = struct.unpack_from('<I', data, offset)
+        offset += 4
+        records.append(GameRecord.fromBytes(data[offset:offset + length]))
+        offset += length
+    return records
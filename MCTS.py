@@ -1,11 +1,20 @@
 import logging
 import math
+import sys
+import time
 import numpy as np
 
 from collections import defaultdict
 
+from Metrics import metrics
+
 EPS = 1e-8
 
+# Proven results for the MCTS-solver, from the perspective of the player to move
+PROVEN_WIN = 1
+PROVEN_DRAW = 0
+PROVEN_LOSS = -1
+
 log = logging.getLogger(__name__)
 
 class TreeLevel():
@@ -17,40 +26,154 @@ class TreeLevel():
         self.Qsa = {}  # stores Q values for s,a (as defined in the paper)
         self.Nsa = {}  # stores #times edge s,a was visited
         self.Ns = {}  # stores #times board s was visited
-        self.Ps = {}  # stores initial policy (returned by neural net)
+        self.Ps = {}  # stores initial policy (returned by neural net) for the actions in As
+        self.As = {}  # stores the valid actions of board s kept at expansion, sorted by prior
+        self.Ks = {}  # stores how many of As[s] are searched before progressive widening
         self.Es = {}  # stores game.getGameEnded ended for board s
-        self.Vs = {}  # stores game.getValidMoves for board s
+        self.Vs = {}  # stores the number of valid moves for board s
+        self.Ss = {}  # stores the proven result of board s (MCTS-solver)
+        self.Cs = {}  # stores the proven results of the children of board s, as {a: result for s}
+        self.Vn = {}  # stores the value returned by neural net for board s
+
+class OpeningCache():
+    """
+    The first `plies` levels of the search tree, shared by the MCTS of every
+    self-play episode played with the same network, since every episode
+    starts from the same position. Nodes found there keep their network
+    outputs and accumulate root statistics across episodes.
+
+    `version` identifies the network the statistics came from; reset() when
+    it changes.
+
+    The cache is per process, not shared between workers: each self-play
+    worker (args.selfPlayWorkers, continuous producers, remote workers)
+    keeps its own, filled by the episodes it plays. So with N workers the
+    opening is searched N times per network version, once by each. The
+    workers outlive network versions, and a shared tree would need a lock
+    around every visit to its nodes.
+    """
+
+    def __init__(self, plies, version=0):
+        self.plies = plies
+        self.reset(version)
+
+    def reset(self, version):
+        self.version = version
+        self.levels = {depth: TreeLevel() for depth in range(self.plies)}
+
 
 class MCTS():
     """
     This class handles the MCTS tree.
     """
 
-    def __init__(self, game, nnet, args):
+    def __init__(self, game, nnet, args, openingCache=None):
         self.game = game
         self.nnet = nnet
         self.args = args
         self.nodes = defaultdict(TreeLevel)
+        self.openingPlies = 0
+        if openingCache is not None:
+            self.nodes.update(openingCache.levels)
+            self.openingPlies = openingCache.plies
+        self.noisedRoot = None  # the last root that got Dirichlet noise
+        self.noisedPriors = None  # its priors with the noise, which the tree itself never holds
+        self.resetStats()
+
+    def resetStats(self):
+        """
+        Zeroes the counters reported by stats(). The tree itself is kept.
+        """
+        self.numSims = 0  # simulations run
+        self.searchTime = 0.0  # seconds spent inside getActionProb's simulation loop
+        self.nodesExpanded = 0  # leaf nodes evaluated by the network
+        self.terminalHits = 0  # simulations that ended in a terminal state
+        self.depthTotal = 0  # sum over simulations of the depth reached
+        self.maskedFallbacks = 0  # "All valid moves were masked" workarounds
+        self.treeReuses = 0  # visits to a node already in the tree, which need no network call
+        self.provenNodes = 0  # boards proven won, lost or drawn by the solver
+        self.simsSaved = 0  # simulations skipped by stopping search early
+        self.simDepth = 0  # depth reached by the simulation in progress
+
+    def stats(self):
+        """
+        Returns:
+            stats: a dict snapshot of the search counters since the last
+                   resetStats(), plus the current size of the tree.
+
+        tree_reuse_rate is the fraction of node visits that found the node
+        already in the tree, against those that expanded it. It is not an
+        evaluation cache hit rate: every node is evaluated once.
+        """
+        visits = self.treeReuses + self.nodesExpanded
+        return {
+            'simulations': self.numSims,
+            'sims_per_sec': self.numSims / self.searchTime if self.searchTime > 0 else 0.0,
+            'nodes_expanded': self.nodesExpanded,
+            'nodes': sum(len(level.Ps) for level in self.nodes.values()),
+            'est_bytes': self.estimateTreeBytes(),
+            'terminal_hits': self.terminalHits,
+            'avg_depth': self.depthTotal / self.numSims if self.numSims else 0.0,
+            'masked_fallbacks': self.maskedFallbacks,
+            'tree_reuse_rate': self.treeReuses / visits if visits else 0.0,
+            'proven_nodes': self.provenNodes,
+            'sims_saved': self.simsSaved,
+        }
+
+    @staticmethod
+    def formatStats(stats):
+        return (f"{stats['simulations']} sims @ {stats['sims_per_sec']:.1f}/s, "
+                f"{stats['nodes']} nodes (~{stats['est_bytes'] / 2 ** 20:.1f} MiB), "
+                f"{stats['nodes_expanded']} expanded, {stats['terminal_hits']} terminal, "
+                f"avg depth {stats['avg_depth']:.2f}, {stats['masked_fallbacks']} masked, "
+                f"tree reuse {stats['tree_reuse_rate']:.2%}, {stats['proven_nodes']} proven, "
+                f"{stats['sims_saved']} sims saved")
+
+    def estimateTreeBytes(self):
+        """
+        Rough memory footprint of the tree: the dicts, their keys and values,
+        and the per node prior / action arrays.
+        """
+        total = 0
+        for level in self.nodes.values():
+            for d in (level.Qsa, level.Nsa, level.Ns, level.Ps, level.As, level.Ks, level.Es, level.Vs, level.Ss, level.Cs, level.Vn):
+                total += sys.getsizeof(d)
+            for s in level.Es:
+                total += sys.getsizeof(s)
+            for key in level.Qsa:
+                # (s, a) tuple + action int + Q float + N int; s is shared with the node keys
+                total += sys.getsizeof(key) + sys.getsizeof(key[1]) + 24 + 28
+            total += sum(p.nbytes for p in level.Ps.values())
+            total += sum(a.nbytes for a in level.As.values())
+        return total
 
-    def getActionProb(self, canonicalBoard, temp=1):
+    def getActionProb(self, canonicalBoard, temp=1, numSims=None):
         """
         This function performs numMCTSSims simulations of MCTS starting from
-        canonicalBoard.
+        canonicalBoard, or numSims simulations if given.
+
+        With args.solver, search stops as soon as the root is proven, and a
+        proven win (or draw) is played without considering visit counts.
+
+        Search also stops early when args.searchTimeLimit (seconds) runs out,
+        or, with args.smartStop and temp=0, once the most visited root move
+        can no longer be overtaken with the simulations that are left.
 
         Returns:
             probs: a policy vector where the probability of the ith action is
                    proportional to Nsa[(s,a)]**(1./temp)
         """
-        for i in range(self.args.numMCTSSims):
-            self.search(canonicalBoard)
-
-        s = self.game.stringRepresentation(canonicalBoard)
-        depth = canonicalBoard.move_count # use to prune unneeded nodes in the tree
+        if numSims is None:
+            numSims = self.args.numMCTSSims
 
-        counts = [self.nodes[depth].Nsa[(s, a)] if (s, a) in self.nodes[depth].Nsa else 0 for a in range(self.game.getActionSize())]
+        if self.args.get('gumbel'):
+            action, probs = self.gumbelSearch(canonicalBoard, numSims)
+            if temp == 0:
+                probs = [0] * len(probs)
+                probs[action] = 1
+            return probs
 
-        if (depth-1) in self.nodes:
-            del self.nodes[depth-1] # Discard the parts of the tree that won't be used anymore
+        counts = self.getRootCounts(canonicalBoard, numSims, smartStop=temp == 0 and self.args.get('smartStop'))
 
         if temp == 0:
             bestAs = np.array(np.argwhere(counts == np.max(counts))).flatten()
@@ -65,6 +188,295 @@ class MCTS():
 
         return probs
 
+    def getRootCounts(self, canonicalBoard, numSims, smartStop=False):
+        """
+        Runs the search of getActionProb from canonicalBoard, stopping early as
+        described there (smartStop only when the move is played greedily).
+        With args.rootNoise, Dirichlet noise is first mixed into the root's
+        priors (see addRootNoise).
+
+        Within the plies of an OpeningCache, a root that already holds
+        numSims visits only gets args.openingFreshSims new simulations.
+
+        Returns:
+            counts: a list with the root visit count of every action, or the
+                    proven result's counts if the solver proved the root
+        """
+        s = self.game.stringRepresentation(canonicalBoard)
+        depth = canonicalBoard.move_count # use to prune unneeded nodes in the tree
+
+        timeLimit = self.args.get('searchTimeLimit')
+        if depth < self.openingPlies and s in self.nodes[depth].Ns and self.nodes[depth].Ns[s] + 1 >= numSims:
+            # earlier episodes have already searched this opening position (its expansion was one simulation)
+            numSims = min(numSims, self.args.get('openingFreshSims', 0))
+
+        def stop(i):
+            if s in self.nodes[depth].Ss:
+                return True
+            if timeLimit and time.perf_counter() - start >= timeLimit:
+                return True
+            return smartStop and i > 0 and self.bestMoveDecided(s, depth, numSims - i)
+
+        start = time.perf_counter()
+        with metrics.timer('mcts.search'):
+            if self.args.get('rootNoise'):
+                if s not in self.nodes[depth].Ps:
+                    self.simulate(canonicalBoard)  # expand the root so there are priors to perturb
+                    numSims -= 1
+                self.addRootNoise(s, depth)
+            i = self.runSimulations(canonicalBoard, numSims, stop)
+            self.simsSaved += numSims - i
+            metrics.incr('mcts.sims_saved', numSims - i)
+            while self.nodes[depth].Ns.get(s, 0) == 0 and s not in self.nodes[depth].Ss:
+                # with very few simulations, they may all have been spent expanding the root
+                self.simulate(canonicalBoard)
+        self.searchTime += time.perf_counter() - start
+
+        counts = self.rootCounts(s, depth)
+
+        if s in self.nodes[depth].Ss:
+            counts = self.provenCounts(s, depth, counts)
+
+        if (depth-1) in self.nodes:
+            del self.nodes[depth-1] # Discard the parts of the tree that won't be used anymore
+
+        return counts
+
+    def addRootNoise(self, s, depth):
+        """
+        Mixes Dirichlet(args.rootNoise) noise into the priors of the root s,
+        with weight args.rootNoiseFrac (default 0.25), once per root. The
+        noisy priors are kept in a copy used by selectAction at s, so nodes
+        shared through an OpeningCache keep the network's priors.
+        """
+        level = self.nodes[depth]
+        if s not in level.Ps or s == self.noisedRoot:
+            return
+        alpha = self.args.rootNoise
+        frac = self.args.get('rootNoiseFrac', 0.25)
+        noise = np.random.dirichlet([alpha] * len(level.Ps[s]))
+        self.noisedPriors = ((1 - frac) * level.Ps[s] + frac * noise).astype(np.float32)
+        self.noisedRoot = s
+
+    def gumbelSearch(self, canonicalBoard, numSims=None):
+        """
+        Root search of Gumbel AlphaZero (Danihelka et al. 2022), which makes
+        better use of a small simulation budget than PUCT at the root.
+
+        The top args.gumbelK moves by prior logit + Gumbel noise are
+        considered, and the budget is split between them by sequential
+        halving: every phase gives each remaining move the same number of
+        simulations, then keeps the better half by
+        gumbel + logit + sigma(q). Below the root, search is the usual PUCT.
+
+        Returns:
+            action: the move that survived sequential halving
+            probs: the improved policy softmax(logit + sigma(completed q)),
+                   a policy vector to train on
+        """
+        if numSims is None:
+            numSims = self.args.numMCTSSims
+
+        s = self.game.stringRepresentation(canonicalBoard)
+        depth = canonicalBoard.move_count
+        level = self.nodes[depth]
+        timeLimit = self.args.get('searchTimeLimit')
+
+        start = time.perf_counter()
+        used = 0
+        with metrics.timer('mcts.search'):
+            if s not in level.Ps and s not in level.Ss:
+                self.simulate(canonicalBoard)  # expand the root
+                used += 1
+
+            lost = {a for a, r in level.Cs.get(s, {}).items() if r == PROVEN_LOSS}
+            if s not in level.Ss and all(a in lost for a in level.As[s].tolist()):
+                # pruning left only moves proven lost to consider
+                self.widenNode(canonicalBoard, s, depth)
+
+            if s not in level.Ss:
+                keep = np.array([a not in lost for a in level.As[s].tolist()], dtype=bool)
+                legal = level.As[s][keep]
+                logits = np.log(level.Ps[s][keep] + EPS)
+                gumbel = np.random.gumbel(size=len(legal))
+
+                k = min(self.args.get('gumbelK', 16), len(legal))
+                considered = np.argsort(-(gumbel + logits))[:k]  # indices into legal
+                numPhases = max(1, math.ceil(math.log2(k)))
+
+                while used < numSims:
+                    simsPerMove = max(1, (numSims - 1) // (numPhases * len(considered)))
+                    for i in considered:
+                        for _ in range(simsPerMove):
+                            if used >= numSims or s in level.Ss:
+                                break
+                            if timeLimit and time.perf_counter() - start >= timeLimit:
+                                break
+                            self.simulateAction(canonicalBoard, s, depth, int(legal[i]))
+                            used += 1
+                    if len(considered) == 1 or s in level.Ss or (timeLimit and time.perf_counter() - start >= timeLimit):
+                        break
+                    scores = gumbel[considered] + logits[considered] + self.sigma(s, depth, legal[considered])
+                    considered = considered[np.argsort(-scores)[:math.ceil(len(considered) / 2)]]
+        self.searchTime += time.perf_counter() - start
+        self.simsSaved += max(0, numSims - used)
+
+        if (depth-1) in self.nodes:
+            del self.nodes[depth-1] # Discard the parts of the tree that won't be used anymore
+
+        if s in level.Ss:
+            probs = self.provenCounts(s, depth, self.rootCounts(s, depth))
+            total = float(sum(probs))
+            probs = [x / total for x in probs]
+            return int(np.argmax(probs)), probs
+
+        scores = gumbel[considered] + logits[considered] + self.sigma(s, depth, legal[considered])
+        action = int(legal[considered[np.argmax(scores)]])
+
+        improved = logits + self.sigma(s, depth, legal, completed=True)
+        improved = np.exp(improved - np.max(improved))
+        improved /= np.sum(improved)
+        probs = np.zeros(self.game.getActionSize())
+        probs[legal] = improved
+        return action, probs.tolist()
+
+    def simulateAction(self, canonicalBoard, s, depth, a):
+        """
+        Runs one simulation from canonicalBoard that starts with action a,
+        instead of picking the root action by PUCT.
+        """
+        self.simDepth = 1
+        with metrics.timer('mcts.nextstate'):
+            next_s, next_player = self.game.getNextState(canonicalBoard, 1, a)
+            next_s = self.game.getCanonicalForm(next_s, next_player)
+        v = self.search(next_s)
+        if self.args.get('solver'):
+            v = self.updateProof(s, depth, a, next_s, v)
+        self.backup(s, depth, a, v)
+        self.depthTotal += self.simDepth
+        self.numSims += 1
+
+    def sigma(self, s, depth, actions, completed=False):
+        """
+        The monotone transform of Q used by Gumbel search,
+        (c_visit + max N) * c_scale * q, with q rescaled from [-1, 1] to [0, 1].
+        Unvisited actions get q = 0, or the mixed value estimate of the root
+        when completed is True.
+        """
+        level = self.nodes[depth]
+        visits = np.array([level.Nsa.get((s, a), 0) for a in actions])
+        q = np.array([level.Qsa.get((s, a), 0.0) for a in actions])
+        if completed:
+            q = np.where(visits > 0, q, self.mixedValue(s, depth))
+        maxN = max((n for (s2, a), n in level.Nsa.items() if s2 == s), default=0)
+        scale = (self.args.get('gumbelCVisit', 50) + maxN) * self.args.get('gumbelCScale', 1.0)
+        return scale * (q + 1) / 2
+
+    def mixedValue(self, s, depth):
+        """
+        The value estimate for unvisited root actions: the network's value of
+        s mixed with the prior weighted Q of the visited actions.
+        """
+        level = self.nodes[depth]
+        prior = dict(zip(level.As[s].tolist(), level.Ps[s].tolist()))
+        total_n = 0
+        visited_p = 0.0
+        weighted_q = 0.0
+        for (s2, a), n in level.Nsa.items():
+            if s2 == s:
+                total_n += n
+                visited_p += prior[a]
+                weighted_q += prior[a] * level.Qsa[(s2, a)]
+        if total_n == 0 or visited_p <= 0:
+            return level.Vn.get(s, 0.0)
+        return (level.Vn.get(s, 0.0) + total_n * weighted_q / visited_p) / (1 + total_n)
+
+    def rootCounts(self, s, depth):
+        """
+        Returns:
+            counts: a list of length getActionSize() with the visit count Nsa
+                    of every action from s
+        """
+        counts = [0] * self.game.getActionSize()
+        if s in self.nodes[depth].As:
+            for a in self.nodes[depth].As[s].tolist():
+                counts[a] = self.nodes[depth].Nsa.get((s, a), 0)
+        return counts
+
+    def bestMoveDecided(self, s, depth, remaining):
+        """
+        Returns:
+            decided: True if the visit lead of the most visited move from s is
+                     larger than the remaining simulations, so it will still
+                     be the most visited move when they have all run.
+        """
+        first = second = 0
+        for (s2, a), n in self.nodes[depth].Nsa.items():
+            if s2 == s:
+                if n > first:
+                    first, second = n, first
+                elif n > second:
+                    second = n
+        return first - second > remaining
+
+    def provenCounts(self, s, depth, counts):
+        """
+        Replaces the visit counts of a proven root: a proven win or draw is
+        played with certainty, and if every move loses, the visit counts are
+        kept (or made uniform over valid moves if nothing was visited).
+        """
+        result = self.nodes[depth].Ss[s]
+        children = self.nodes[depth].Cs.get(s, {})
+        best = [a for a, r in children.items() if r == result]
+        if result != PROVEN_LOSS and best:
+            counts = [0] * len(counts)
+            counts[best[0]] = 1
+        elif sum(counts) == 0:
+            counts = [0] * len(counts)
+            for a in self.nodes[depth].As[s].tolist():
+                counts[a] = 1
+        return counts
+
+    def getRootValue(self, canonicalBoard):
+        """
+        Returns:
+            v: the visit weighted average of Q over the edges searched from
+               canonicalBoard, i.e. the search's estimate of the value of
+               canonicalBoard for the player to move. 0 if nothing was searched.
+        """
+        s = self.game.stringRepresentation(canonicalBoard)
+        level = self.nodes[canonicalBoard.move_count]
+        n_total = 0
+        q_total = 0.0
+        for (s2, a), n in level.Nsa.items():
+            if s2 == s:
+                n_total += n
+                q_total += n * level.Qsa[(s2, a)]
+        return q_total / n_total if n_total else 0.0
+
+    def runSimulations(self, canonicalBoard, numSims, stop):
+        """
+        Runs up to numSims simulations from canonicalBoard, asking stop(i)
+        before the ith whether to end the search early.
+
+        Returns:
+            i: the number of simulations run
+        """
+        for i in range(numSims):
+            if stop(i):
+                return i
+            self.simulate(canonicalBoard)
+        return numSims
+
+    def simulate(self, canonicalBoard):
+        """
+        Runs one simulation from canonicalBoard and records it in the stats.
+        """
+        self.simDepth = 0
+        self.search(canonicalBoard)
+        self.depthTotal += self.simDepth
+        self.numSims += 1
+
     def search(self, canonicalBoard):
         """
         This function performs one iteration of MCTS. It is recursively called
@@ -84,66 +496,287 @@ class MCTS():
         Returns:
             v: the negative of the value of the current canonicalBoard
         """
-        s = self.game.stringRepresentation(canonicalBoard)
+        with metrics.timer('mcts.hash'):
+            s = self.game.stringRepresentation(canonicalBoard)
         depth = canonicalBoard.move_count
+        self.simDepth += 1
 
         if s not in self.nodes[depth].Es:
-            self.nodes[depth].Es[s] = self.game.getGameEnded(canonicalBoard, 1)
+            with metrics.timer('mcts.gameended'):
+                self.nodes[depth].Es[s] = self.game.getGameEnded(canonicalBoard, 1)
         if self.nodes[depth].Es[s] != 0:
             # terminal node
+            self.terminalHits += 1
+            if self.args.get('solver') and s not in self.nodes[depth].Ss:
+                e = self.nodes[depth].Es[s]
+                self.nodes[depth].Ss[s] = PROVEN_WIN if e >= 1 else PROVEN_LOSS if e <= -1 else PROVEN_DRAW
             return -self.nodes[depth].Es[s]
 
+        if s in self.nodes[depth].Ss:
+            # proven by the solver, no need to search any further
+            return -self.nodes[depth].Ss[s]
+
         if s not in self.nodes[depth].Ps:
             # leaf node
-            self.nodes[depth].Ps[s], v = self.nnet.predict(canonicalBoard)
+            v = self.expand(canonicalBoard, s, depth)
+            if s in self.nodes[depth].Ss:
+                return -self.nodes[depth].Ss[s]
+            return -v
+
+        self.treeReuses += 1
+
+        a = self.selectAction(canonicalBoard, s, depth)
+        with metrics.timer('mcts.nextstate'):
+            next_s, next_player = self.game.getNextState(canonicalBoard, 1, a)
+            next_s = self.game.getCanonicalForm(next_s, next_player)
+
+        v = self.search(next_s)
+
+        if self.args.get('solver'):
+            v = self.updateProof(s, depth, a, next_s, v)
+
+        self.backup(s, depth, a, v)
+        return -v
+
+    def expand(self, canonicalBoard, s, depth):
+        """
+        Evaluates the leaf canonicalBoard with the network and adds it to the
+        tree. Only the valid actions are stored, sorted by prior (narrowed by
+        game.filterSearchActions with args.duckCandidates), and with
+        args.expandTopK / args.expandMass only the most probable of them are
+        searched (see expansionWidth). With args.expandWiden the rest are kept
+        too, and brought into the search as the node's visits grow.
+
+        Returns:
+            v: the network's value of canonicalBoard for the player to move
+        """
+        return self.addNode(canonicalBoard, s, depth, *self.evaluate(canonicalBoard))
+
+    def evaluate(self, canonicalBoard):
+        """
+        Runs the network and the move generator on canonicalBoard. With
+        args.legalOnlyEval the network only computes the valid actions' priors.
+
+        Returns:
+            priors: the network's priors of the valid actions
+            v: the network's value of canonicalBoard
+            valids: the vector returned by game.getValidMoves
+        """
+        with metrics.timer('mcts.movegen'):
             valids = self.game.getValidMoves(canonicalBoard, 1)
-            self.nodes[depth].Ps[s] = self.nodes[depth].Ps[s] * valids  # masking invalid moves
-            sum_Ps_s = np.sum(self.nodes[depth].Ps[s])
-            if sum_Ps_s > 0:
-                self.nodes[depth].Ps[s] /= sum_Ps_s  # renormalize
+        actions = np.flatnonzero(valids)
+        with metrics.timer('mcts.inference'):
+            if self.args.get('legalOnlyEval'):
+                priors, v = self.nnet.predict(canonicalBoard, actions)
             else:
-                # if all valid moves were masked make all valid moves equally probable
+                pi, v = self.nnet.predict(canonicalBoard)
+                priors = pi[actions]  # masking invalid moves
+        return priors, v, valids
 
-                # NB! All valid moves may be masked if either your NNet architecture is insufficient or you've get overfitting or something else.
-                # If you have got dozens or hundreds of these messages you should pay attention to your NNet and/or training process.   
-                log.error("All valid moves were masked, doing a workaround.")
-                self.nodes[depth].Ps[s] = self.nodes[depth].Ps[s] + valids
-                self.nodes[depth].Ps[s] /= np.sum(self.nodes[depth].Ps[s])
+    def addNode(self, canonicalBoard, s, depth, priors, v, valids):
+        """
+        Stores the network's priors of the valid moves (in the order of
+        np.flatnonzero(valids)) and value v for the leaf s as a new node of
+        the tree.
 
-            self.nodes[depth].Vs[s] = valids
-            self.nodes[depth].Ns[s] = 0
-            return -v
+        Returns:
+            v: v as a float
+        """
+        v = np.asarray(v).item()
+        num_valids = int(np.count_nonzero(valids))
+        actions, priors = self.sortedActions(canonicalBoard, priors, valids)
+        width = self.expansionWidth(priors)
+        if not self.args.get('expandWiden'):
+            actions = actions[:width]
+            priors = priors[:width]
+
+        level = self.nodes[depth]
+        level.As[s] = actions.astype(np.int32)
+        level.Ps[s] = priors.astype(np.float32)
+        level.Ks[s] = width
+        level.Vs[s] = num_valids
+        level.Vn[s] = v
+        level.Ns[s] = 0
+        self.nodesExpanded += 1
+
+        if self.args.get('solver'):
+            wins = self.game.getWinningMoves(canonicalBoard, valids)
+            if len(wins):
+                level.Cs[s] = {int(a): PROVEN_WIN for a in wins}
+                level.Ss[s] = PROVEN_WIN
+                self.provenNodes += 1
+        return v
 
-        valids = self.nodes[depth].Vs[s]
+    def sortedActions(self, canonicalBoard, priors, valids, filterActions=True):
+        """
+        Input:
+            priors: the network's priors of the valid moves, in the order of
+                    np.flatnonzero(valids)
+            filterActions: whether to apply args.duckCandidates
+
+        Returns:
+            (actions, priors): the valid moves narrowed by
+            game.filterSearchActions with args.duckCandidates, and their
+            renormalized priors, sorted by prior descending
+        """
+        actions = np.flatnonzero(valids)
+        if filterActions and self.args.get('duckCandidates'):
+            keep = self.game.filterSearchActions(canonicalBoard, actions, priors, self.args.duckCandidates)
+            actions = actions[keep]
+            priors = priors[keep]
+        sum_Ps_s = np.sum(priors)
+        if sum_Ps_s > 0:
+            priors = priors / sum_Ps_s  # renormalize
+        else:
+            # if all valid moves were masked make all valid moves equally probable
+
+            # NB! All valid moves may be masked if either your NNet architecture is insufficient or you've get overfitting or something else.
+            # If you have got dozens or hundreds of these messages you should pay attention to your NNet and/or training process.   
+            log.error("All valid moves were masked, doing a workaround.")
+            self.maskedFallbacks += 1
+            priors = np.full(len(actions), 1.0 / len(actions))
+
+        order = np.argsort(-priors, kind='stable')
+        return actions[order], priors[order]
+
+    def expansionWidth(self, priors):
+        """
+        Input:
+            priors: the priors of a node's valid actions, sorted descending
+
+        Returns:
+            width: how many of them to search; the top args.expandTopK, or the
+                   fewest covering args.expandMass of the probability, or all.
+        """
+        width = len(priors)
+        if self.args.get('expandTopK'):
+            width = min(width, self.args.expandTopK)
+        if self.args.get('expandMass'):
+            width = min(width, int(np.searchsorted(np.cumsum(priors), self.args.expandMass)) + 1)
+        return max(width, 1)
+
+    def selectAction(self, canonicalBoard, s, depth):
+        """
+        Returns:
+            a: the action from s with the highest upper confidence bound, among
+               the searched actions of As[s] (see searchWidth) that are not
+               proven lost. If the solver has proven all of them lost, the
+               node is widened first (see widenNode).
+        """
+        level = self.nodes[depth]
         cur_best = -float('inf')
         best_act = -1
+        # moves the solver has proven to lose are never searched again
+        lost = {a for a, r in level.Cs.get(s, {}).items() if r == PROVEN_LOSS}
+        width = self.searchWidth(s, depth)
 
         # pick the action with the highest upper confidence bound
-        for a in range(self.game.getActionSize()):
-            if valids[a]:
-                if (s, a) in self.nodes[depth].Qsa:
-                    u = self.nodes[depth].Qsa[(s, a)] + self.args.cpuct * self.nodes[depth].Ps[s][a] * math.sqrt(self.nodes[depth].Ns[s]) / (
-                            1 + self.nodes[depth].Nsa[(s, a)])
+        with metrics.timer('mcts.select'):
+            actions = level.As[s][:width].tolist()
+            priors = (self.noisedPriors if s == self.noisedRoot else level.Ps[s])[:width].tolist()
+            for a, p in zip(actions, priors):
+                if lost and a in lost:
+                    continue
+                if (s, a) in level.Qsa:
+                    u = level.Qsa[(s, a)] + self.args.cpuct * p * math.sqrt(level.Ns[s]) / (
+                            1 + level.Nsa[(s, a)])
                 else:
-                    u = self.args.cpuct * self.nodes[depth].Ps[s][a] * math.sqrt(self.nodes[depth].Ns[s] + EPS)  # Q = 0 ?
+                    u = self.args.cpuct * p * math.sqrt(level.Ns[s] + EPS)  # Q = 0 ?
 
                 if u > cur_best:
                     cur_best = u
                     best_act = a
+        if best_act == -1:
+            if self.widenNode(canonicalBoard, s, depth):
+                return self.selectAction(canonicalBoard, s, depth)
+            best_act = int(level.As[s][0])  # s is proven lost now; any move returns that proof
+        return best_act
 
-        a = best_act
-        next_s, next_player = self.game.getNextState(canonicalBoard, 1, a)
-        next_s = self.game.getCanonicalForm(next_s, next_player)
+    def searchWidth(self, s, depth):
+        """
+        Returns:
+            width: how many of As[s] are searched; Ks[s], plus
+                   args.expandWiden * sqrt(N(s)) with progressive widening
+        """
+        level = self.nodes[depth]
+        width = level.Ks[s]
+        if self.args.get('expandWiden'):
+            width += int(self.args.expandWiden * math.sqrt(level.Ns[s]))
+        return min(width, len(level.As[s]))
 
-        v = self.search(next_s)
+    def widenNode(self, canonicalBoard, s, depth):
+        """
+        Called when the solver has proven every searched action of s lost,
+        while pruning (args.expandTopK, expandMass, expandWiden) kept other
+        moves out of the search, so s itself is not proven. Brings the next
+        move that is not proven lost into the search, first restoring the
+        moves that were dropped at expansion by evaluating s again. If the
+        duck placements kept by args.duckCandidates are all lost too, the
+        filtered out placements are restored as well, since a proof over a
+        subset of the moves proves nothing about s. If there is no such
+        move, s is proven lost.
+
+        Returns:
+            True if s was widened, False if it was proven lost
+        """
+        level = self.nodes[depth]
+        lost = {a for a, r in level.Cs.get(s, {}).items() if r == PROVEN_LOSS}
+        if len(level.As[s]) < level.Vs[s] and all(a in lost for a in level.As[s].tolist()):
+            priors, _, valids = self.evaluate(canonicalBoard)
+            actions, sortedPriors = self.sortedActions(canonicalBoard, priors, valids)
+            if len(actions) < level.Vs[s] and all(a in lost for a in actions.tolist()):
+                actions, sortedPriors = self.sortedActions(canonicalBoard, priors, valids, filterActions=False)
+            level.As[s] = actions.astype(np.int32)
+            level.Ps[s] = sortedPriors.astype(np.float32)
+            if s == self.noisedRoot:
+                self.noisedRoot = None  # noise the restored priors afresh
+                self.addRootNoise(s, depth)
+        for i, a in enumerate(level.As[s].tolist()):
+            if a not in lost:
+                level.Ks[s] += max(0, i + 1 - self.searchWidth(s, depth))
+                return True
+        level.Ss[s] = PROVEN_LOSS
+        self.provenNodes += 1
+        return False
+
+    def backup(self, s, depth, a, v):
+        """
+        Adds the value v, from the perspective of the player to move at s, to
+        the running average Qsa of the edge (s, a), and counts the visit.
+        """
+        with metrics.timer('mcts.backup'):
+            if (s, a) in self.nodes[depth].Qsa:
+                self.nodes[depth].Qsa[(s, a)] = (self.nodes[depth].Nsa[(s, a)] * self.nodes[depth].Qsa[(s, a)] + v) / (self.nodes[depth].Nsa[(s, a)] + 1)
+                self.nodes[depth].Nsa[(s, a)] += 1
+
+            else:
+                self.nodes[depth].Qsa[(s, a)] = v
+                self.nodes[depth].Nsa[(s, a)] = 1
+
+            self.nodes[depth].Ns[s] += 1
 
-        if (s, a) in self.nodes[depth].Qsa:
-            self.nodes[depth].Qsa[(s, a)] = (self.nodes[depth].Nsa[(s, a)] * self.nodes[depth].Qsa[(s, a)] + v) / (self.nodes[depth].Nsa[(s, a)] + 1)
-            self.nodes[depth].Nsa[(s, a)] += 1
+    def updateProof(self, s, depth, a, next_s, v):
+        """
+        MCTS-solver backup: if the child reached by a from s is proven,
+        record it, and try to prove s. s is won as soon as one child is lost
+        for the opponent, and otherwise proven once every valid child is.
 
+        Returns:
+            v: the value to back up for (s, a); the proven value once s is proven
+        """
+        child_s = self.game.stringRepresentation(next_s)
+        child_result = self.nodes[depth + 1].Ss.get(child_s)
+        if child_result is None:
+            return v
+
+        children = self.nodes[depth].Cs.setdefault(s, {})
+        children[a] = -child_result
+        if -child_result == PROVEN_WIN:
+            self.nodes[depth].Ss[s] = PROVEN_WIN
+        elif len(children) == self.nodes[depth].Vs[s]:
+            self.nodes[depth].Ss[s] = max(children.values())
         else:
-            self.nodes[depth].Qsa[(s, a)] = v
-            self.nodes[depth].Nsa[(s, a)] = 1
+            return v
 
-        self.nodes[depth].Ns[s] += 1
-        return -v
+        self.provenNodes += 1
+        return self.nodes[depth].Ss[s]
@@ -0,0 +1,156 @@
+import json
+import logging
+import os
+import time
+
+from collections import defaultdict
+
+log = logging.getLogger(__name__)
+
+
+class _Timer():
+    """
+    Context manager that adds the elapsed time of its block to a Metrics phase.
+    """
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.metrics.add(self.name, time.perf_counter() - self.start)
+        return False
+
+
+class _NullTimer():
+    """
+    Stand-in for _Timer when metrics are disabled, so the hot paths only pay
+    for an attribute lookup and two empty calls.
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Metrics():
+    """
+    Accumulates wall time and call counts per named phase (move generation,
+    hashing, network inference, ...), and writes them out once per iteration.
+
+    A single module level instance, `metrics`, is shared by Coach, MCTS and the
+    network wrapper. It is disabled by default, in which case timer() hands out
+    a shared no-op context manager.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.seconds = defaultdict(float)  # stores total wall time per phase
+        self.calls = defaultdict(int)  # stores number of timed calls per phase
+        self.counters = defaultdict(int)  # stores plain event counts (games, examples, ...)
+        self.started = time.time()
+
+    def timer(self, name):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def add(self, name, seconds, n=1):
+        self.seconds[name] += seconds
+        self.calls[name] += n
+
+    def incr(self, name, n=1):
+        if self.enabled:
+            self.counters[name] += n
+
+    def snapshot(self):
+        """
+        Returns:
+            snapshot: a dict with the elapsed wall time since the last reset,
+                      and the seconds, calls and counters collected so far.
+        """
+        phases = {}
+        for name in sorted(self.seconds):
+            phases[name] = {
+                'seconds': self.seconds[name],
+                'calls': self.calls[name],
+                'mean_ms': 1000 * self.seconds[name] / self.calls[name] if self.calls[name] else 0.0,
+            }
+        return {
+            'wall_seconds': time.time() - self.started,
+            'phases': phases,
+            'counters': dict(self.counters),
+        }
+
+    def merge(self, snapshot):
+        """
+        Adds the seconds, calls and counters of a snapshot() taken in another
+        process (e.g. a self-play worker) to this one. Phase times of
+        concurrent workers add up, so they can exceed the wall time.
+        """
+        for name, p in snapshot['phases'].items():
+            self.add(name, p['seconds'], p['calls'])
+        for name, n in snapshot['counters'].items():
+            self.counters[name] += n
+
+    def toPrometheus(self, labels=None):
+        """
+        Renders the current snapshot in the Prometheus text exposition format.
+        """
+        snap = self.snapshot()
+        base = [f'{k}="{v}"' for k, v in sorted((labels or {}).items())]
+
+        def sample(name, value, key=None, key_value=None):
+            parts = base + ([f'{key}="{key_value}"'] if key else [])
+            label_str = '{' + ','.join(parts) + '}' if parts else ''
+            return f'{name}{label_str} {value}'
+
+        lines = ['# TYPE duckzero_phase_seconds_total counter']
+        for name, p in snap['phases'].items():
+            lines.append(sample('duckzero_phase_seconds_total', f"{p['seconds']:.6f}", 'phase', name))
+        lines.append('# TYPE duckzero_phase_calls_total counter')
+        for name, p in snap['phases'].items():
+            lines.append(sample('duckzero_phase_calls_total', p['calls'], 'phase', name))
+        lines.append('# TYPE duckzero_events_total counter')
+        for name, n in sorted(snap['counters'].items()):
+            lines.append(sample('duckzero_events_total', n, 'event', name))
+        lines.append('# TYPE duckzero_wall_seconds gauge')
+        lines.append(sample('duckzero_wall_seconds', f"{snap['wall_seconds']:.3f}"))
+        return '\n'.join(lines) + '\n'
+
+    def save(self, folder, filename, fmt='json', labels=None):
+        """
+        Writes the current snapshot to folder/filename, either as 'json' or as
+        'prometheus' text format.
+        """
+        if not os.path.exists(folder):
+            os.makedirs(folder)
+        filepath = os.path.join(folder, filename)
+        if fmt == 'prometheus':
+            content = self.toPrometheus(labels)
+        else:
+            snap = self.snapshot()
+            if labels:
+                snap['labels'] = labels
+            content = json.dumps(snap, indent=2)
+        with open(filepath, 'w') as f:
+            f.write(content)
+        log.info(f"Metrics written to {filepath}")
+        return filepath
+
+
+metrics = Metrics()
@@ -11,7 +11,7 @@ class NeuralNet():
     def __init__(self, game):
         pass
 
-    def train(self, examples):
+    def train(self, examples, epochs=None, samples=None):
         """
         This function trains the neural network with examples obtained from
         self-play.
@@ -21,17 +21,26 @@ class NeuralNet():
                       (board, pi, v). pi is the MCTS informed policy vector for
                       the given board, and v is its value. The examples has
                       board in its canonical form.
+            epochs: number of passes over examples, overriding the network's
+                    default when given.
+            samples: if given, train on this many samples drawn from
+                     examples instead of whole epochs (used by the continuous
+                     pipeline to train at a fixed sample/replay ratio).
         """
         pass
 
-    def predict(self, board):
+    def predict(self, board, actions=None):
         """
         Input:
             board: current board in its canonical form.
+            actions: optional array of action indices (MCTS passes the valid
+                     ones with args.legalOnlyEval). Networks that support it
+                     only compute these.
 
         Returns:
             pi: a policy vector for the current board- a numpy array of length
-                game.getActionSize
+                game.getActionSize, or, if actions is given, the probabilities
+                of just those actions, normalized over them
             v: a float in [-1,1] that gives the value of the current board
         """
         pass
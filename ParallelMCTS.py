@@ -0,0 +1,267 @@
+import logging
+import multiprocessing as mp
+import os
+import random
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from MCTS import MCTS, PROVEN_DRAW, PROVEN_LOSS, PROVEN_WIN
+from Metrics import metrics
+from utils import dotdict
+
+log = logging.getLogger(__name__)
+
+
+class ThreadedMCTS(MCTS):
+    """
+    MCTS that runs the simulations of one move on args.numThreads threads
+    sharing the same tree, to cut the latency of a single search on a
+    many-core host (interactive play, analysis).
+
+    Threads descend iteratively instead of recursively. Every edge on a
+    thread's path carries args.virtualLoss visits valued as losses until its
+    simulation is backed up, which steers the other threads to different
+    lines. All reads and writes of the tree happen under one lock; the
+    expensive parts, network evaluation (torch releases the GIL) and move
+    generation, run outside it. A thread that reaches a leaf another thread
+    is already evaluating waits for that evaluation instead of repeating it.
+
+    The Gumbel root search stays sequential.
+    """
+
+    def __init__(self, game, nnet, args):
+        super().__init__(game, nnet, args)
+        self.numThreads = self.args.get('numThreads') or os.cpu_count()
+        self.virtualLoss = self.args.get('virtualLoss', 1)
+        self.lock = threading.Lock()
+        self.pending = {}  # stores an Event for each (depth, s) being evaluated by some thread
+        self.pool = ThreadPoolExecutor(max_workers=self.numThreads, thread_name_prefix='mcts')
+
+    def runSimulations(self, canonicalBoard, numSims, stop):
+        claimed = 0
+
+        def worker():
+            nonlocal claimed
+            while True:
+                with self.lock:
+                    if claimed >= numSims or stop(claimed):
+                        return
+                    claimed += 1
+                self.simulate(canonicalBoard)
+
+        futures = [self.pool.submit(worker) for _ in range(self.numThreads)]
+        for future in futures:
+            future.result()
+        return claimed
+
+    def simulate(self, canonicalBoard):
+        """
+        Runs one simulation from canonicalBoard; safe to call from several
+        threads at once.
+        """
+        path = []  # (s, depth, a, next board) of the edges taken
+        board = canonicalBoard
+        while True:
+            with metrics.timer('mcts.hash'):
+                s = self.game.stringRepresentation(board)
+            depth = board.move_count
+
+            with self.lock:
+                level = self.nodes[depth]
+                if s not in level.Es:
+                    with metrics.timer('mcts.gameended'):
+                        level.Es[s] = self.game.getGameEnded(board, 1)
+                if level.Es[s] != 0:
+                    # terminal node
+                    self.terminalHits += 1
+                    e = level.Es[s]
+                    if self.args.get('solver') and s not in level.Ss:
+                        level.Ss[s] = PROVEN_WIN if e >= 1 else PROVEN_LOSS if e <= -1 else PROVEN_DRAW
+                    v = -e
+                    break
+                if s in level.Ss:
+                    v = -level.Ss[s]
+                    break
+                if s in level.Ps:
+                    self.treeReuses += 1
+                    a = self.selectAction(board, s, depth)
+                    self.addVirtualLoss(s, depth, a)
+                    evaluating = None
+                else:
+                    evaluating = self.pending.get((depth, s))
+                    if evaluating is None:
+                        self.pending[(depth, s)] = threading.Event()
+
+            if evaluating is not None:
+                # another thread is expanding this leaf, use its result
+                evaluating.wait()
+                continue
+            if s not in level.Ps:
+                v = -self.expandShared(board, s, depth)
+                break
+
+            with metrics.timer('mcts.nextstate'):
+                next_s, next_player = self.game.getNextState(board, 1, a)
+                next_s = self.game.getCanonicalForm(next_s, next_player)
+            path.append((s, depth, a, next_s))
+            board = next_s
+
+        with self.lock:
+            for s, depth, a, next_s in reversed(path):
+                self.removeVirtualLoss(s, depth, a)
+                if self.args.get('solver'):
+                    v = self.updateProof(s, depth, a, next_s, v)
+                self.backup(s, depth, a, v)
+                v = -v
+            self.depthTotal += len(path) + 1
+            self.numSims += 1
+
+    def expandShared(self, canonicalBoard, s, depth):
+        """
+        expand() for a leaf this thread has claimed in self.pending: evaluates
+        it without holding the lock, then adds the node and wakes up the
+        threads waiting for it.
+
+        Returns:
+            v: the value of canonicalBoard for the player to move, or its
+               proven result if the solver proved it at expansion
+        """
+        try:
+            priors, v, valids = self.evaluate(canonicalBoard)
+            with self.lock:
+                v = self.addNode(canonicalBoard, s, depth, priors, v, valids)
+                if s in self.nodes[depth].Ss:
+                    v = self.nodes[depth].Ss[s]
+        finally:
+            with self.lock:
+                self.pending.pop((depth, s)).set()
+        return v
+
+    def addVirtualLoss(self, s, depth, a):
+        """
+        Counts args.virtualLoss pending visits of (s, a), each valued as a loss.
+        """
+        level = self.nodes[depth]
+        vl = self.virtualLoss
+        if (s, a) in level.Qsa:
+            n = level.Nsa[(s, a)]
+            level.Qsa[(s, a)] = (n * level.Qsa[(s, a)] - vl) / (n + vl)
+            level.Nsa[(s, a)] = n + vl
+        else:
+            level.Qsa[(s, a)] = -1
+            level.Nsa[(s, a)] = vl
+        level.Ns[s] += vl
+
+    def removeVirtualLoss(self, s, depth, a):
+        level = self.nodes[depth]
+        vl = self.virtualLoss
+        n = level.Nsa[(s, a)] - vl
+        if n == 0:
+            del level.Qsa[(s, a)]
+            del level.Nsa[(s, a)]
+        else:
+            level.Qsa[(s, a)] = (level.Nsa[(s, a)] * level.Qsa[(s, a)] + vl) / n
+            level.Nsa[(s, a)] = n
+        level.Ns[s] -= vl
+
+    def close(self):
+        self.pool.shutdown()
+
+
+def _rootWorker(conn, game, nnet, args, seed):
+    # Worker process of RootParallelMCTS: keeps one tree for the game in
+    # progress and answers (board, numSims, smartStop) requests with the
+    # nonzero root visit counts, whether the root is proven, and its stats.
+    np.random.seed(seed)
+    random.seed(seed)
+    mcts = MCTS(game, nnet, args)
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        if request == 'reset':
+            mcts.resetStats()
+            continue
+        board, numSims, smartStop = request
+        counts = mcts.getRootCounts(board, numSims, smartStop)
+        proven = game.stringRepresentation(board) in mcts.nodes[board.move_count].Ss
+        conn.send(({a: n for a, n in enumerate(counts) if n}, proven, mcts.stats()))
+    conn.close()
+
+
+class RootParallelMCTS(MCTS):
+    """
+    Root-parallel search: args.numProcesses worker processes each search the
+    same position with their own tree, a different seed and Dirichlet noise
+    on the root priors (args.rootNoise, 0.3 if unset), and their root visit
+    counts are summed. If any worker proves the root, its result is used.
+
+    The workers persist across moves, so each keeps reusing its own subtree
+    like a single MCTS does. Call close() once the game or match is over.
+    The Gumbel root search is not parallelised and runs in this process.
+    """
+
+    def __init__(self, game, nnet, args):
+        self.conns = []
+        super().__init__(game, nnet, args)
+        numProcesses = self.args.get('numProcesses') or os.cpu_count()
+        workerArgs = dotdict({**self.args, 'rootNoise': self.args.get('rootNoise') or 0.3})
+        seed = self.args.get('seed', np.random.randint(2 ** 31 - numProcesses))
+        self.workers = []
+        for i in range(numProcesses):
+            conn, child_conn = mp.Pipe()
+            worker = mp.Process(target=_rootWorker, args=(child_conn, game, nnet, workerArgs, seed + i), daemon=True)
+            worker.start()
+            child_conn.close()
+            self.conns.append(conn)
+            self.workers.append(worker)
+        self.workerStats = [None] * numProcesses  # latest stats() of each worker
+
+    def resetStats(self):
+        super().resetStats()
+        for conn in self.conns:
+            conn.send('reset')
+        self.workerStats = [None] * len(self.conns)
+
+    def getRootCounts(self, canonicalBoard, numSims, smartStop=False):
+        start = time.perf_counter()
+        for conn in self.conns:
+            conn.send((canonicalBoard, numSims, smartStop))
+        counts = [0] * self.game.getActionSize()
+        provenCounts = None
+        for i, conn in enumerate(self.conns):
+            visits, proven, self.workerStats[i] = conn.recv()
+            if proven and provenCounts is None:
+                provenCounts = [0] * self.game.getActionSize()
+                for a, n in visits.items():
+                    provenCounts[a] = n
+            for a, n in visits.items():
+                counts[a] += n
+        self.searchTime += time.perf_counter() - start
+        return provenCounts or counts
+
+    def stats(self):
+        """
+        Returns:
+            stats: the workers' stats() combined; counts and sizes are summed,
+                   averages are weighted by simulations.
+        """
+        workerStats = [st for st in self.workerStats if st is not None]
+        if not workerStats:
+            return super().stats()
+        combined = {key: sum(st[key] for st in workerStats) for key in workerStats[0]}
+        sims = combined['simulations']
+        for key in ('avg_depth', 'tree_reuse_rate'):
+            combined[key] = sum(st[key] * st['simulations'] for st in workerStats) / sims if sims else 0.0
+        return combined
+
+    def close(self):
+        for conn in self.conns:
+            conn.send(None)
+        for worker in self.workers:
+            worker.join()
+        self.conns = []
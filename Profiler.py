@@ -0,0 +1,111 @@
+import cProfile
+import logging
+import os
+import sys
+import threading
+import time
+
+from collections import Counter
+
+log = logging.getLogger(__name__)
+
+
+class StackSampler():
+    """
+    Samples the Python stack of one thread at a fixed interval and counts the
+    collapsed stacks ("outer;inner;innermost count"), which is the input
+    format of flamegraph.pl and speedscope.
+    """
+
+    def __init__(self, interval=0.005, thread_id=None):
+        self.interval = interval
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name='StackSampler', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                continue
+            names = []
+            while frame is not None:
+                code = frame.f_code
+                names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                frame = frame.f_back
+            self.stacks[';'.join(reversed(names))] += 1
+
+    def save(self, filepath):
+        with open(filepath, 'w') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class PhaseProfiler():
+    """
+    Context manager that profiles the enclosed block with cProfile, a stack
+    sampler and (if available) the torch profiler, and writes
+
+        <folder>/profile_<phase>.prof        (cProfile, for pstats/snakeviz)
+        <folder>/profile_<phase>.collapsed   (collapsed stacks, for flamegraphs)
+        <folder>/profile_<phase>.trace.json  (Chrome trace, for chrome://tracing)
+
+    Everything is off outside the block, so only the chosen phases pay for it.
+    """
+
+    def __init__(self, folder, phase, sampleInterval=0.005, torchProfile=True):
+        self.folder = folder
+        self.phase = phase
+        self.sampleInterval = sampleInterval
+        self.torchProfile = torchProfile
+        self.torchProf = None
+
+    def path(self, ext):
+        return os.path.join(self.folder, f"profile_{self.phase}.{ext}")
+
+    def __enter__(self):
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        log.info(f"Profiling phase '{self.phase}'...")
+        self.start = time.time()
+        if self.torchProfile:
+            try:
+                import torch
+                activities = [torch.profiler.ProfilerActivity.CPU]
+                if torch.cuda.is_available():
+                    activities.append(torch.profiler.ProfilerActivity.CUDA)
+                self.torchProf = torch.profiler.profile(activities=activities)
+                self.torchProf.__enter__()
+            except (ImportError, AttributeError) as e:
+                log.warning(f"Torch profiler unavailable, skipping the Chrome trace: {e}")
+                self.torchProf = None
+        self.sampler = StackSampler(self.sampleInterval)
+        self.sampler.start()
+        self.cprofile = cProfile.Profile()
+        self.cprofile.enable()
+        return self
+
+    def __exit__(self, *exc):
+        self.cprofile.disable()
+        self.sampler.stop()
+        if self.torchProf is not None:
+            self.torchProf.__exit__(*exc)
+
+        self.cprofile.dump_stats(self.path('prof'))
+        self.sampler.save(self.path('collapsed'))
+        written = [self.path('prof'), self.path('collapsed')]
+        if self.torchProf is not None:
+            self.torchProf.export_chrome_trace(self.path('trace.json'))
+            written.append(self.path('trace.json'))
+        log.info(f"Profiled '{self.phase}' for {time.time() - self.start:.1f}s, wrote {', '.join(written)}")
+        return False
@@ -0,0 +1,307 @@
+import hmac
+import json
+import logging
+import os
+import socket
+import struct
+import tempfile
+import threading
+import time
+from collections import deque
+
+from GameRecord import GameRecord
+from Metrics import metrics
+from utils import dotdict, writer
+
+log = logging.getLogger(__name__)
+
+# Frame types. Every frame is a 4 byte big-endian payload length, a type byte
+# and the payload.
+HELLO = 1      # worker -> coordinator: JSON {'name', 'token'}
+CONFIG = 2     # coordinator -> worker: JSON of the Coach args
+READY = 3      # worker -> coordinator: asks for a task
+MODEL = 4      # coordinator -> worker: uint32 version + checkpoint file bytes
+TASK = 5       # coordinator -> worker: JSON {'task', 'version'}
+GAME = 6       # worker -> coordinator: uint32 task + uint32 info length + JSON info (incl. metrics) + GameRecord bytes
+HEARTBEAT = 7  # worker -> coordinator: empty, sent every heartbeatInterval seconds
+STOP = 8       # coordinator -> worker: empty, no more work
+
+_HEADER = struct.Struct('>IB')
+
+
+def sendFrame(sock, kind, payload=b''):
+    sock.sendall(_HEADER.pack(len(payload), kind) + payload)
+
+
+def recvFrame(sock):
+    """
+    Returns:
+        (kind, payload) of the next frame; raises ConnectionError if the
+        connection closes.
+    """
+    length, kind = _HEADER.unpack(_recvExactly(sock, _HEADER.size))
+    return kind, _recvExactly(sock, length)
+
+
+def _recvExactly(sock, n):
+    chunks = []
+    while n > 0:
+        chunk = sock.recv(min(n, 1 << 20))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b''.join(chunks)
+
+
+class Coordinator():
+    """
+    Hands out self-play games to remote workers (see Worker) over TCP.
+
+    Workers connect to args.coordinatorHost:args.coordinatorPort and say
+    hello with args.coordinatorToken; a worker with another token is
+    dropped. Listening on anything but the loopback interface requires a
+    token, as a worker receives the model and its games become training
+    examples. Workers then receive the Coach args and ask for one game at a
+    time. Each task comes with the current model
+    version, whose checkpoint the worker is sent first if it has an older
+    one. Games come back as GameRecords, which are replayed here into
+    training examples. While playing, workers send heartbeats; a worker that disconnects
+    or stays silent for args.heartbeatTimeout seconds loses its task, which
+    goes back to the front of the queue for another worker.
+    """
+
+    def __init__(self, game, args):
+        self.game = game
+        self.args = args
+        host = args.get('coordinatorHost') or '127.0.0.1'
+        if not args.get('coordinatorToken') and host not in ('127.0.0.1', 'localhost', '::1'):
+            raise ValueError(f"Serving self-play on {host} requires a coordinatorToken")
+        self.model = None  # (version, checkpoint bytes)
+        self.tasks = deque()
+        self.results = {}  # task -> (examples, seconds, searchStats, record, resignStats) of the current playGames()
+        self.generation = 0  # tasks of earlier playGames() calls are stale
+        self.connected = 0  # workers currently connected
+        self.closed = False
+        self.cond = threading.Condition()
+        self.server = socket.create_server((host, args.coordinatorPort))
+        self.port = self.server.getsockname()[1]
+        threading.Thread(target=self.acceptLoop, daemon=True).start()
+        log.info(f"Coordinator listening on port {self.port}")
+
+    def publish(self, nnet):
+        """
+        Makes nnet's weights the model version of all tasks handed out from now on.
+        """
+        folder = self.args.checkpoint
+        nnet.save_checkpoint(folder=folder, filename='remote.pth.tar')
+        writer.wait()
+        with open(os.path.join(folder, 'remote.pth.tar'), 'rb') as f:
+            data = f.read()
+        with self.cond:
+            version = self.model[0] + 1 if self.model else 1
+            self.model = (version, data)
+        log.info(f"Published model version {version} ({len(data) / 1e6:.1f}MB)")
+
+    def playGames(self, numEps):
+        """
+        Queues numEps games and waits until remote workers have played them
+        all, warning every args.heartbeatTimeout seconds while it waits. Gives
+        up once no game has come in for args.remoteWaitTimeout seconds (None
+        waits forever), dropping the games not played yet.
+
+        Returns:
+            (games, resignStats): the playEpisode() result of every game
+            played, possibly fewer than numEps, and the summed resignation
+            counts
+        """
+        waitTimeout = self.args.get('remoteWaitTimeout')
+        with self.cond:
+            self.generation += 1
+            self.results = {}
+            self.tasks = deque((self.generation, k) for k in range(numEps))
+            self.cond.notify_all()
+            lastGame = time.monotonic()
+            played = 0
+            while len(self.results) < numEps:
+                if not self.cond.wait(timeout=self.args.get('heartbeatTimeout', 60)):
+                    log.warning(f"Waiting for remote workers: {len(self.results)}/{numEps} games played, "
+                                f"{self.connected} workers connected on port {self.port}")
+                if len(self.results) > played:
+                    played = len(self.results)
+                    lastGame = time.monotonic()
+                elif waitTimeout is not None and time.monotonic() - lastGame > waitTimeout:
+                    log.warning(f"No remote game for {waitTimeout}s, giving up on {numEps - played} games")
+                    self.tasks.clear()
+                    self.generation += 1  # games still in progress are stale now
+                    break
+            results = list(self.results.values())
+        resignStats = {}
+        for *_, stats in results:
+            for key, n in stats.items():
+                resignStats[key] = resignStats.get(key, 0) + n
+        return [r[:4] for r in results], resignStats
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+        self.server.close()
+
+    def acceptLoop(self):
+        while not self.closed:
+            try:
+                conn, address = self.server.accept()
+            except OSError:
+                break
+            threading.Thread(target=self.serve, args=(conn, address), daemon=True).start()
+
+    def nextTask(self):
+        # blocks until there is a task, or returns None once closed
+        with self.cond:
+            while not self.tasks and not self.closed:
+                self.cond.wait()
+            if self.closed:
+                return None
+            return self.tasks.popleft(), self.model
+
+    def serve(self, conn, address):
+        # one connected worker, until it disconnects, times out or is stopped
+        name = f"{address[0]}:{address[1]}"
+        task = None
+        version = None
+        connected = False
+        try:
+            conn.settimeout(self.args.get('heartbeatTimeout', 60))
+            kind, payload = recvFrame(conn)
+            if kind != HELLO:
+                raise ConnectionError(f"expected HELLO, got frame type {kind}")
+            hello = json.loads(payload)
+            name = hello.get('name') or name
+            if not hmac.compare_digest(str(hello.get('token') or ''), str(self.args.get('coordinatorToken') or '')):
+                raise ConnectionError("wrong token")
+            log.info(f"Worker {name} connected")
+            with self.cond:
+                self.connected += 1
+            connected = True
+            sendFrame(conn, CONFIG, json.dumps(dict(self.args)).encode())
+            while True:
+                kind, payload = recvFrame(conn)
+                if kind == READY:
+                    nextTask = self.nextTask()
+                    if nextTask is None:
+                        sendFrame(conn, STOP)
+                        break
+                    task, (modelVersion, model) = nextTask
+                    if version != modelVersion:
+                        sendFrame(conn, MODEL, struct.pack('>I', modelVersion) + model)
+                        version = modelVersion
+                    sendFrame(conn, TASK, json.dumps({'task': task, 'version': version}).encode())
+                elif kind == GAME:
+                    taskId, infoLength = struct.unpack_from('>II', payload)
+                    info = json.loads(payload[8:8 + infoLength])
+                    record = GameRecord.fromBytes(payload[8 + infoLength:])
+                    examples = record.examples(self.game)
+                    with self.cond:
+                        metrics.merge(info['metrics'])
+                        if task is not None and task[1] == taskId and task[0] == self.generation:
+                            self.results[task] = (examples, info['seconds'], info['searchStats'], record,
+                                                  info['resignStats'])
+                            self.cond.notify_all()
+                    task = None
+                elif kind != HEARTBEAT:
+                    raise ConnectionError(f"unexpected frame type {kind}")
+        except (OSError, ConnectionError, ValueError) as e:
+            log.warning(f"Lost worker {name}: {e}")
+        finally:
+            conn.close()
+            with self.cond:
+                self.connected -= connected
+            if task is not None:
+                with self.cond:
+                    if task[0] == self.generation and task not in self.results:
+                        log.info(f"Reassigning game {task[1]} of worker {name}")
+                        self.tasks.appendleft(task)
+                        self.cond.notify_all()
+
+
+class Worker():
+    """
+    Plays self-play games for a Coordinator at host:port until it says STOP.
+    makeCoach(args) must return a Coach for the received args; the worker
+    loads every model version into its nnet and plays with its playEpisode().
+    Reconnects after losing the connection. token must match the
+    coordinator's args.coordinatorToken.
+    """
+
+    def __init__(self, host, port, name=None, token=None):
+        self.host = host
+        self.port = port
+        self.token = token
+        self.name = name or f"{socket.gethostname()}-{os.getpid()}"
+        self.folder = tempfile.mkdtemp(prefix='selfplay_worker_')
+        self.coach = None
+
+    def run(self, makeCoach):
+        while True:
+            try:
+                with socket.create_connection((self.host, self.port)) as sock:
+                    if self.serve(sock, makeCoach):
+                        return
+            except (OSError, ConnectionError) as e:
+                log.warning(f"Connection to {self.host}:{self.port} failed: {e}; retrying")
+                time.sleep(5)
+
+    def serve(self, sock, makeCoach):
+        # Returns True when the coordinator says STOP
+        sendLock = threading.Lock()
+        stopped = threading.Event()
+
+        def send(kind, payload=b''):
+            with sendLock:
+                sendFrame(sock, kind, payload)
+
+        send(HELLO, json.dumps({'name': self.name, 'token': self.token}).encode())
+        kind, payload = recvFrame(sock)
+        # the coordinator may have restarted with other args, and sends the model afresh anyway
+        args = dotdict(json.loads(payload))
+        self.coach = makeCoach(args)
+
+        def heartbeat():
+            while not stopped.wait(args.get('heartbeatInterval', 5)):
+                try:
+                    send(HEARTBEAT)
+                except OSError:
+                    break
+        threading.Thread(target=heartbeat, daemon=True).start()
+
+        try:
+            while True:
+                send(READY)
+                kind, payload = recvFrame(sock)
+                if kind == STOP:
+                    log.info("Coordinator has no more work, stopping")
+                    return True
+                if kind == MODEL:
+                    self.loadModel(struct.unpack_from('>I', payload)[0], payload[4:])
+                    kind, payload = recvFrame(sock)
+                task = json.loads(payload)['task']
+                self.coach.resignStats = {key: 0 for key in self.coach.resignStats}
+                metrics.reset()
+                _, seconds, searchStats, record = self.coach.playEpisode()
+                info = json.dumps({'seconds': seconds, 'searchStats': searchStats,
+                                   'resignStats': self.coach.resignStats, 'metrics': metrics.snapshot()},
+                                  default=float).encode()
+                data = record.toBytes()
+                send(GAME, struct.pack('>II', task[1], len(info)) + info + data)
+                log.info(f"Game {task[1]} sent ({len(record)} plies, {len(data)} bytes) in {seconds:.1f}s")
+        finally:
+            stopped.set()
+
+    def loadModel(self, version, data):
+        with open(os.path.join(self.folder, 'model.pth.tar'), 'wb') as f:
+            f.write(data)
+        self.coach.nnet.load_checkpoint(self.folder, 'model.pth.tar')
+        if self.coach.openingCache is not None:
+            self.coach.openingCache.reset(version)
+        log.info(f"Loaded model version {version}")
@@ -0,0 +1,64 @@
+import logging
+
+import torch
+import torch.multiprocessing as mp
+
+log = logging.getLogger(__name__)
+
+
+class SharedWeights():
+    """
+    A network's weights in shared memory, so worker processes can use them
+    without each loading its own copy. Workers attach() a network whose
+    parameters are the shared tensors themselves, and must only read them.
+
+    The weights live in two slots. publish() writes a new version into the
+    slot the workers are not using and then switches to it, and workers call
+    refresh() between games to move to the latest version, so a game is
+    never played with weights that change under it.
+    """
+
+    def __init__(self, nnet):
+        self.config = dict(nnet.config)
+        state = nnet.model.state_dict()
+        self.slots = [{name: tensor.detach().cpu().clone().share_memory_() for name, tensor in state.items()}
+                      for _ in range(2)]
+        self.version = mp.Value('l', 0)  # the latest version lives in slots[version % 2]
+        self.publish(nnet)
+
+    def publish(self, nnet):
+        """
+        Copies the weights of nnet into shared memory as the next version.
+        """
+        with self.version.get_lock():
+            slot = self.slots[(self.version.value + 1) % 2]
+            with torch.no_grad():
+                for name, tensor in nnet.model.state_dict().items():
+                    slot[name].copy_(tensor)
+            self.version.value += 1
+        log.info(f"Published weights version {self.version.value}")
+
+    def attach(self, nnetClass, game):
+        """
+        In a worker: builds a network of nnetClass, which must accept
+        (game, config, meta=True), on the latest shared weights.
+        """
+        nnet = nnetClass(game, self.config, meta=True)
+        nnet.weightsVersion = None
+        self.refresh(nnet)
+        return nnet
+
+    def refresh(self, nnet):
+        """
+        Switches an attached network to the latest version.
+
+        Returns:
+            True if the weights changed
+        """
+        with self.version.get_lock():
+            version = self.version.value
+            if nnet.weightsVersion == version:
+                return False
+            nnet.model.load_state_dict(self.slots[version % 2], assign=True)
+        nnet.weightsVersion = version
+        return True
@@ -30,10 +30,9 @@ def main():
 
     g = DuckChessGame()
 
-    n1 = nn(g)
-    n1.load_checkpoint(folder=args.model_dir, filename=args.model_name)
+    n1 = nn.fromCheckpoint(g, folder=args.model_dir, filename=args.model_name)
 
-    args1 = dotdict({'numMCTSSims': 20, 'cpuct':1.0, 'verbose': False})
+    args1 = dotdict({'numMCTSSims': 20, 'cpuct':1.0, 'solver': True, 'smartStop': True, 'verbose': False})
     mcts1 = MCTS(g, n1, args1)
     n1p = lambda x: np.argmax(mcts1.getActionProb(x, temp=0))
 
@@ -0,0 +1,63 @@
+from duckchess.DuckChessGame import DuckChessGame
+from duckchess.DuckChessNetWrapper import NNetWrapper as nn
+from duckchess.DuckChessNetWrapper import args as nnet_args
+
+import argparse
+import os
+
+import logging
+import coloredlogs
+
+from pickle import Unpickler
+
+from GameRecord import readRecords
+
+log = logging.getLogger(__name__)
+coloredlogs.install(level='DEBUG')
+
+"""
+Distill a trained model into a smaller one, for cheap self-play and evaluation
+"""
+def main():
+    parser = argparse.ArgumentParser(
+        prog='distill.py',
+        description="Train a small model to mimic a large model's policy and value"
+    )
+    parser.add_argument('teacher_dir', help="Directory with the saved model to distill")
+    parser.add_argument('teacher_name', help="Name of the file, e.g. 'checkpoint_5.pth.tar'")
+    parser.add_argument('examples', help="Replay buffer to take positions from, e.g. 'temp/checkpoint_5.pth.tar.examples', "
+                                             "or an archive of game records ('.records')")
+    parser.add_argument('--net', default='small', help="Network size preset of the student: tiny, small, medium or full")
+    parser.add_argument('--epochs', type=int, default=None, help="Passes over the positions (default: the network's training epochs)")
+    parser.add_argument('--outcome-weight', type=float, default=0.0,
+                        help="Weight of the game outcome, against the teacher's value, in the value target")
+    parser.add_argument('--out-dir', default=None, help="Directory to save the student in (default: teacher_dir)")
+    parser.add_argument('--out-name', default=None, help="File name of the student (default: distilled_<net>_<teacher_name>)")
+    args = parser.parse_args()
+
+    g = DuckChessGame()
+
+    teacher = nn(g)
+    teacher.load_checkpoint(folder=args.teacher_dir, filename=args.teacher_name)
+
+    if args.examples.endswith('.records'):
+        examples = [e for record in readRecords(args.examples) for e in record.examples(g)]
+    else:
+        with open(args.examples, "rb") as f:
+            history = Unpickler(f).load()
+        examples = [e for iteration in history for e in iteration]
+    log.info(f"Distilling {args.teacher_name} into a '{args.net}' network on {len(examples)} positions")
+
+    nnet_args.net = args.net
+    student = nn(g)
+    log.info(f"Teacher: {teacher.summary()}")
+    log.info(f"Student: {student.summary()}")
+    student.distill(teacher, examples, epochs=args.epochs, outcome_weight=args.outcome_weight)
+
+    out_dir = args.out_dir or args.teacher_dir
+    out_name = args.out_name or f"distilled_{args.net}_{args.teacher_name}"
+    student.save_checkpoint(folder=out_dir, filename=out_name).result()
+    log.info(f"Saved the student to {os.path.join(out_dir, out_name)}")
+
+if __name__ == "__main__":
+    main()
@@ -73,7 +73,38 @@ class DuckChessGame(Game):
                small non-zero value for draw.
                
         """
-        return player * board.checkForGameOver(verbose)
+        # The board is always kept from the perspective of the player to move,
+        # which is the player every caller asks about
+        return board.checkForGameOver(verbose)
+
+    def getWinningMoves(self, board, valids):
+        """
+        Input:
+            board: current board in its canonical form
+            valids: the vector returned by getValidMoves(board, 1)
+
+        Returns:
+            winningMoves: the valid actions that capture the opponent's king,
+                          which ends the game immediately (there is no check
+                          in duck chess).
+        """
+        return board.getKingCaptureMoves(valids)
+
+    def filterSearchActions(self, board, actions, priors, n):
+        """
+        Input:
+            board: current board in its canonical form
+            actions: the valid actions of board considered by the search
+            priors: the network's prior of each of them
+            n: number of most probable duck placements kept per chess move
+
+        Returns:
+            keep: a boolean mask over actions. For each chess move, the duck
+                  placements on a line out of either king, next to the moving
+                  piece's from or destination square, or among the move's n
+                  most probable placements.
+        """
+        return board.filterDuckPlacements(actions, priors, n)
 
     def getCanonicalForm(self, board, player):
         """
@@ -33,6 +33,21 @@ OPP_QUEENSIDE_CASTLE_LAYER = 16
 OPP_KINGSIDE_CASTLE_LAYER = 17
 MOVE_COUNT_LAYER = 18
 
+# Draw rules
+NO_PROGRESS_LIMIT = 100     # halfmoves without a capture or pawn move (the 50 move rule)
+REPETITION_LIMIT = 3        # occurrences of the same position (threefold repetition)
+
+# (rank, file) steps of the eight queen lines, used to find duck squares that shield a king
+KING_LINES = ((-1, 0), (-1, 1), (0, 1), (1, 1), (1, 0), (1, -1), (0, -1), (-1, -1))
+
+# Zobrist keys for the incremental position hash, indexed by [square][piece + 7].
+# Squares and pieces are taken from white's point of view, so a position
+# hashes the same whichever side the board is currently flipped towards.
+_zobrist_rng = np.random.default_rng(20221205)
+ZOBRIST_PIECES = _zobrist_rng.integers(1, 2**63, size=(64, 15), dtype=np.int64).tolist()
+ZOBRIST_BLACK_TO_MOVE = int(_zobrist_rng.integers(1, 2**63, dtype=np.int64))
+ZOBRIST_CASTLING = _zobrist_rng.integers(1, 2**63, size=4, dtype=np.int64).tolist()
+
 class Pieces(IntEnum):
     PLAYER_P = 1
     PLAYER_R = 2
@@ -96,7 +111,10 @@ class DuckChessBoard():
         self.opponent_can_castle_queenside = True
         self.opponent_can_castle_kingside = True
         self.duck_location = None
-        #TODO repetition counts?, 50move, and en passant
+        self.halfmove_clock = 0  # halfmoves since the last capture or pawn move
+        self.zobrist = self.computeZobrist()  # hash of the piece placement, updated incrementally
+        self.history = [self.positionKey()]  # position keys since the last capture or pawn move
+        #TODO en passant
     
     def encode(self):
         board = np.zeros((NUM_PLANES, 8, 8))
@@ -334,6 +352,44 @@ class DuckChessBoard():
     def getRelativeMoveIndex(self, direction, amount):
         return direction*7+amount-1
     
+    def getKingCaptureMoves(self, valids):
+        # Flat indices of the valid actions that land on the opponent's king
+        king = np.flatnonzero(self.pieces == Pieces.OPPONENT_K)
+        if len(king) == 0:
+            return np.array([], dtype=np.int64)
+        captures = MOVE_DESTINATIONS == king[0]
+        return np.flatnonzero(valids.reshape(8, 8, 73, 64) & captures[..., np.newaxis])
+
+    def getKingLineSquares(self):
+        # Empty squares on the queen lines out of either king, up to the first
+        # piece. A duck there can shield a king or cut off its escape.
+        lines = np.zeros(64, dtype=bool)
+        for king in (Pieces.PLAYER_K, Pieces.OPPONENT_K):
+            for rank, file in zip(*np.nonzero(self.pieces == king)):
+                for rank_direction, file_direction in KING_LINES:
+                    r, f = rank + rank_direction, file + file_direction
+                    while 0 <= r < 8 and 0 <= f < 8 and self.pieces[r][f] == 0:
+                        lines[r * 8 + f] = True
+                        r += rank_direction
+                        f += file_direction
+        return lines
+
+    def filterDuckPlacements(self, actions, priors, n):
+        # For each chess move among the flat action indices, keep the duck
+        # squares on a king line, around the from or destination square, and
+        # the move's n placements with the highest prior
+        moves = actions // 64
+        ducks = actions % 64
+        keep = self.getKingLineSquares()[ducks]
+        keep |= NEIGHBOURHOODS[moves // 73, ducks]
+        keep |= NEIGHBOURHOODS[MOVE_DESTINATIONS.reshape(-1)[moves], ducks]
+        order = np.lexsort((-np.asarray(priors), moves))
+        grouped = moves[order]
+        ranks = np.empty(len(actions), dtype=np.int64)
+        ranks[order] = np.arange(len(actions)) - np.searchsorted(grouped, grouped)
+        keep |= ranks < n
+        return keep
+
     def getPossibleDuckMoves(self, prev_rank, prev_file, next_rank, next_file):
         # Encode the 8x8 locations that the duck can be moved to next
         # This is all the currently empty spaces on the board,
@@ -409,6 +465,39 @@ class DuckChessBoard():
             # TODO underpromotions
             raise Exception(f"Move type {move_type} not implemented yet")
 
+    def zobristKey(self, rank, file, piece):
+        # Convert from the current player's perspective to white's
+        if not self.white_to_move:
+            rank = 7 - rank
+            piece = -piece
+        if piece == -Pieces.DUCK:
+            # the duck belongs to nobody
+            piece = Pieces.DUCK
+        return ZOBRIST_PIECES[rank * 8 + file][piece + 7]
+
+    def computeZobrist(self):
+        z = 0
+        for rank, file in zip(*np.nonzero(self.pieces)):
+            z ^= self.zobristKey(rank, file, int(self.pieces[rank][file]))
+        return z
+
+    def positionKey(self):
+        """
+        Hash of everything that makes two positions the same for the
+        repetition rule: piece placement, side to move and castling rights.
+        """
+        key = self.zobrist
+        if not self.white_to_move:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        white_rights = (self.player_can_castle_queenside, self.player_can_castle_kingside)
+        black_rights = (self.opponent_can_castle_queenside, self.opponent_can_castle_kingside)
+        if not self.white_to_move:
+            white_rights, black_rights = black_rights, white_rights
+        for i, can_castle in enumerate(white_rights + black_rights):
+            if can_castle:
+                key ^= ZOBRIST_CASTLING[i]
+        return key
+
     def performMove(self, action, verbose):
         rank, file, move_type, duck_rank, duck_file = self.decodeAction(action)
 
@@ -429,21 +518,30 @@ class DuckChessBoard():
             else:
                 log.debug(f"Black moved {7-rank},{file} to {7-new_rank},{new_file}, and duck to {duck_rank},{duck_file}")
         
+        captured = self.pieces[new_rank][new_file]
+        irreversible = captured != 0 or piece == Pieces.PLAYER_P
+        self.zobrist ^= self.zobristKey(rank, file, piece)
+        if captured != 0:
+            self.zobrist ^= self.zobristKey(new_rank, new_file, captured)
+
         # Check for promotion
         if new_rank == 0 and piece == Pieces.PLAYER_P:
-            piece == Pieces.PLAYER_Q
+            piece = Pieces.PLAYER_Q
 
         # Move the piece
+        self.zobrist ^= self.zobristKey(new_rank, new_file, piece)
         self.pieces[rank][file] = 0
         self.pieces[new_rank][new_file] = piece
 
         if self.duck_location:
             old_duck_rank, old_duck_file = self.duck_location
             self.pieces[old_duck_rank][old_duck_file] = 0
+            self.zobrist ^= self.zobristKey(old_duck_rank, old_duck_file, Pieces.DUCK)
 
         # Negative bc we are about to flip the board to the other player's perspective
         self.pieces[duck_rank][duck_file] = -1 * Pieces.DUCK
         self.duck_location = (7-duck_rank, duck_file)
+        self.zobrist ^= self.zobristKey(duck_rank, duck_file, Pieces.DUCK)
 
         # Flip the board around now for other player's perspective
         # Note that this is technically mirrored, so that the 'images' 
@@ -459,10 +557,19 @@ class DuckChessBoard():
         self.white_to_move = not self.white_to_move
         self.player_can_castle_queenside, self.opponent_can_castle_queenside = self.opponent_can_castle_queenside, self.player_can_castle_queenside
         self.player_can_castle_kingside, self.opponent_can_castle_kingside = self.opponent_can_castle_kingside, self.player_can_castle_kingside
+
+        # Only positions since the last capture or pawn move can repeat
+        if irreversible:
+            self.halfmove_clock = 0
+            self.history = [self.positionKey()]
+        else:
+            self.halfmove_clock += 1
+            self.history.append(self.positionKey())
     
     def checkForGameOver(self, verbose):
+        # Result from the perspective of the player to move:
+        # -1 if they lost (their king was captured), small value for a draw, 0 if ongoing
         # todo stalemates
-        # todo draw due to repetition
         if not np.any(self.pieces == Pieces.PLAYER_K):
             if verbose:
                 if self.white_to_move:
@@ -470,18 +577,28 @@ class DuckChessBoard():
                 else:
                     log.info(f"White wins after {self.move_count} moves")
                 self.display()
-            return 1
+            return -1
         if not np.any(self.pieces == Pieces.OPPONENT_K):
             # This shouldn't happen, but checking bc not sure which player is which
             raise Exception("Opponent already lost, you shouldn't have another turn")
+        if self.halfmove_clock >= NO_PROGRESS_LIMIT:
+            if verbose:
+                log.info(f"Draw by the 50 move rule after {self.move_count} moves")
+            return 0.1
+        if self.history.count(self.history[-1]) >= REPETITION_LIMIT:
+            if verbose:
+                log.info(f"Draw by repetition after {self.move_count} moves")
+            return 0.1
         if self.move_count >= 300:
             # Game is taking too long, call it a draw
             return 0.1
         return 0
     
     def hashKey(self):
-        return f"{np.array2string(self.pieces)}${self.move_count}${self.white_to_move}{self.player_can_castle_queenside}" +\
-            f"{self.player_can_castle_kingside}{self.opponent_can_castle_queenside}{self.opponent_can_castle_kingside}"
+        # The repetition count and halfmove clock are part of the key, since they
+        # decide whether the game is over
+        position = self.history[-1]
+        return f"{position:x}${self.move_count}${self.halfmove_clock}${self.history.count(position)}"
 
     def display(self):
         pieces = self.pieces
@@ -538,4 +655,38 @@ class DuckChessBoard():
                     symbol = '@'
                 print(symbol, end=" ")
             print("")
-        print("------------------")
\ No newline at end of file
+        print("------------------")
+
+
+def _moveDestinations():
+    # For each (rank, file, move_type) of the action encoding, the square
+    # (rank * 8 + file) the piece lands on, or -1 if it would leave the board
+    destinations = np.full((8, 8, 73), -1, dtype=np.int16)
+    board = DuckChessBoard.__new__(DuckChessBoard)  # only used for decodeChessMove
+    for move_type in range(64):
+        rank_offset, file_offset = board.decodeChessMove(move_type)
+        for rank in range(8):
+            for file in range(8):
+                new_rank = rank + rank_offset
+                new_file = file + file_offset
+                if 0 <= new_rank < 8 and 0 <= new_file < 8:
+                    destinations[rank][file][move_type] = new_rank * 8 + new_file
+    return destinations
+
+
+MOVE_DESTINATIONS = _moveDestinations()
+
+
+def _neighbourhoods():
+    # [square][other] is True if other is square itself or one of its (up to
+    # eight) adjacent squares
+    neighbourhoods = np.zeros((64, 64), dtype=bool)
+    for square in range(64):
+        rank, file = divmod(square, 8)
+        for other in range(64):
+            other_rank, other_file = divmod(other, 8)
+            neighbourhoods[square][other] = abs(rank - other_rank) <= 1 and abs(file - other_file) <= 1
+    return neighbourhoods
+
+
+NEIGHBOURHOODS = _neighbourhoods()
@@ -3,17 +3,26 @@ import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
 
+# Named network sizes, selected with args.net in DuckChessNetWrapper.
+# 'full' is the original architecture, which older checkpoints were trained with.
+NET_PRESETS = {
+    'tiny': {'channels': 32, 'num_blocks': 3, 'shortcut': 'identity', 'se': False, 'policy_head': 'conv'},
+    'small': {'channels': 64, 'num_blocks': 6, 'shortcut': 'identity', 'se': True, 'policy_head': 'conv'},
+    'medium': {'channels': 128, 'num_blocks': 10, 'shortcut': 'identity', 'se': True, 'policy_head': 'conv'},
+    'full': {'channels': 256, 'num_blocks': 12, 'shortcut': 'conv', 'se': False, 'policy_head': 'linear'},
+}
+
 class DuckChessModel(nn.Module):
-    def __init__(self, game):
+    def __init__(self, game, channels=256, num_blocks=12, shortcut='conv', se=False, policy_head='linear'):
         super(DuckChessModel, self).__init__()
 
         self.input_shape = game.getBoardSize()
         self.action_size = game.getActionSize()
 
         input_channels = self.input_shape[0]
-        intermediate_channels = 256
+        intermediate_channels = channels
         kernel_size = 3
-        num_residual_blocks = 12
+        num_residual_blocks = num_blocks
 
         self.conv1 = nn.Sequential(
             nn.Conv2d(input_channels, intermediate_channels, kernel_size, stride=1, padding=1),
@@ -23,16 +32,19 @@ class DuckChessModel(nn.Module):
 
         self.residual_blocks = nn.Sequential()
         for i in range(num_residual_blocks):
-            self.residual_blocks.append(ResidualBlock(intermediate_channels, intermediate_channels, kernel_size))
+            self.residual_blocks.append(ResidualBlock(intermediate_channels, intermediate_channels, kernel_size, shortcut, se))
 
-        self.policy_head = nn.Sequential(
-            nn.Conv2d(intermediate_channels, 2, 1, stride=1, padding=0),
-            nn.BatchNorm2d(2),
-            nn.ReLU(),
-            nn.Flatten(),
-            nn.Linear(128, self.action_size),
-            nn.LogSoftmax(dim=1)
-        )
+        if policy_head == 'conv':
+            self.policy_head = ConvPolicyHead(intermediate_channels)
+        else:
+            self.policy_head = nn.Sequential(
+                nn.Conv2d(intermediate_channels, 2, 1, stride=1, padding=0),
+                nn.BatchNorm2d(2),
+                nn.ReLU(),
+                nn.Flatten(),
+                nn.Linear(128, self.action_size),
+                nn.LogSoftmax(dim=1)
+            )
 
         self.value_head = nn.Sequential(
             nn.Conv2d(intermediate_channels, 1, 1, stride=1, padding=0),
@@ -45,30 +57,136 @@ class DuckChessModel(nn.Module):
             nn.Tanh()
         )
 
-    def forward(self, x):
+    def forward(self, x, actions=None):
         x = self.conv1(x)
         x = self.residual_blocks(x)
 
-        pi = self.policy_head(x)
+        if actions is None:
+            pi = self.policy_head(x)
+        else:
+            pi = self.legal_policy(x, actions)
         v = self.value_head(x)
 
         return pi, v
 
+    def legal_policy(self, x, actions):
+        # Log-probabilities of only the given flat action indices, normalized
+        # over them, computing just their logits
+        if isinstance(self.policy_head, ConvPolicyHead):
+            return self.policy_head.legal(x, actions)
+        features = self.policy_head[:4](x)
+        linear = self.policy_head[4]
+        logits = F.linear(features, linear.weight[actions], linear.bias[actions])
+        return F.log_softmax(logits, dim=1)
+
 class ResidualBlock(nn.Module):
-    def __init__(self, input_channels, output_channels, kernel_size):
+    def __init__(self, input_channels, output_channels, kernel_size, shortcut='conv', se=False):
         super(ResidualBlock, self).__init__()
         self.conv1 = nn.Conv2d(input_channels, output_channels, kernel_size, stride=1, padding=1)
         self.bn1 = nn.BatchNorm2d(output_channels)
         self.conv2 = nn.Conv2d(input_channels, output_channels, kernel_size, stride=1, padding=1)
         self.bn2 =  nn.BatchNorm2d(output_channels)
-        self.shortcut = nn.Sequential(
-            nn.Conv2d(input_channels, output_channels, kernel_size, stride=1, padding=1),
-            nn.BatchNorm2d(output_channels)
-        )
+        self.se = SqueezeExcitation(output_channels) if se else nn.Identity()
+        if shortcut == 'identity' and input_channels == output_channels:
+            self.shortcut = nn.Identity()
+        else:
+            self.shortcut = nn.Sequential(
+                nn.Conv2d(input_channels, output_channels, kernel_size, stride=1, padding=1),
+                nn.BatchNorm2d(output_channels)
+            )
 
     def forward(self, x):
         out = F.relu(self.bn1(self.conv1(x)))
-        out = self.bn2(self.conv2(out))
+        out = self.se(self.bn2(self.conv2(out)))
         out += self.shortcut(x)
         out = F.relu(out)
-        return out
\ No newline at end of file
+        return out
+
+class SqueezeExcitation(nn.Module):
+    """
+    Rescales each channel by a gate computed from the globally pooled
+    channels (Hu et al. 2018), letting the network weigh board-wide context.
+    """
+    def __init__(self, channels, ratio=4):
+        super(SqueezeExcitation, self).__init__()
+        self.gate = nn.Sequential(
+            nn.AdaptiveAvgPool2d(1),
+            nn.Flatten(),
+            nn.Linear(channels, channels // ratio),
+            nn.ReLU(),
+            nn.Linear(channels // ratio, channels),
+            nn.Sigmoid()
+        )
+
+    def forward(self, x):
+        return x * self.gate(x)[:, :, None, None]
+
+class ConvPolicyHead(nn.Module):
+    """
+    Policy head without the Linear(128, 299008) layer. The 8x8x73 chess moves
+    are scored by a 1x1 convolution, and the duck square of each move by the
+    dot product of a per move query, read at the move's from square, with a
+    per square key. Returns the same flat log-probabilities over
+    rank x file x move type x duck square as the linear head.
+    """
+    def __init__(self, input_channels, head_channels=32, move_types=73, duck_dim=8):
+        super(ConvPolicyHead, self).__init__()
+        self.duck_dim = duck_dim
+        self.conv = nn.Sequential(
+            nn.Conv2d(input_channels, head_channels, 1, stride=1, padding=0),
+            nn.BatchNorm2d(head_channels),
+            nn.ReLU()
+        )
+        self.move_logits = nn.Conv2d(head_channels, move_types, 1, stride=1, padding=0)
+        self.duck_queries = nn.Conv2d(head_channels, move_types * duck_dim, 1, stride=1, padding=0)
+        self.duck_keys = nn.Conv2d(head_channels, duck_dim, 1, stride=1, padding=0)
+
+    def forward(self, x):
+        x = self.conv(x)
+        batch_size = x.size(0)
+        # (batch, rank, file, move type) -> one row per chess move
+        moves = self.move_logits(x).permute(0, 2, 3, 1).reshape(batch_size, -1, 1)
+        queries = self.duck_queries(x).permute(0, 2, 3, 1).reshape(batch_size, -1, self.duck_dim)
+        keys = self.duck_keys(x).flatten(2)
+        ducks = torch.bmm(queries, keys) / self.duck_dim ** 0.5
+        return F.log_softmax((moves + ducks).flatten(1), dim=1)
+
+    def legal(self, x, actions):
+        # forward() restricted to the given flat action indices
+        x = self.conv(x)
+        batch_size = x.size(0)
+        moves = self.move_logits(x).permute(0, 2, 3, 1).reshape(batch_size, -1)
+        queries = self.duck_queries(x).permute(0, 2, 3, 1).reshape(batch_size, -1, self.duck_dim)
+        keys = self.duck_keys(x).flatten(2)
+        move_ids = actions // 64
+        duck_ids = actions % 64
+        ducks = (queries[:, move_ids] * keys[:, :, duck_ids].transpose(1, 2)).sum(2) / self.duck_dim ** 0.5
+        return F.log_softmax(moves[:, move_ids] + ducks, dim=1)
+
+def summarize(model):
+    """
+    Returns the number of parameters of model and the multiply-adds of one
+    forward pass for a single board, counted over its conv and linear layers.
+    """
+    macs = 0
+
+    def count(module, inputs, output):
+        nonlocal macs
+        if isinstance(module, nn.Conv2d):
+            macs += output.numel() * module.in_channels // module.groups * module.kernel_size[0] * module.kernel_size[1]
+        elif isinstance(module, nn.Linear):
+            macs += output.numel() * module.in_features
+
+    hooks = [m.register_forward_hook(count) for m in model.modules() if isinstance(m, (nn.Conv2d, nn.Linear))]
+    was_training = model.training
+    model.eval()
+    try:
+        with torch.no_grad():
+            device = next(model.parameters()).device
+            model(torch.zeros(1, *model.input_shape, device=device))
+    finally:
+        for hook in hooks:
+            hook.remove()
+        model.train(was_training)
+    params = sum(p.numel() for p in model.parameters())
+    return params, macs
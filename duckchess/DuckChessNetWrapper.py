@@ -1,18 +1,31 @@
+import logging
 import os
+import socket
 import sys
-import time
+from contextlib import nullcontext
 
 import numpy as np
 from tqdm import tqdm
 
 sys.path.append('../../')
 from utils import *
+from Metrics import metrics
 from NeuralNet import NeuralNet
 
 import torch
+import torch.distributed as dist
+import torch.multiprocessing
 import torch.optim as optim
+from torch.nn.parallel import DistributedDataParallel
 
 from .DuckChessNN import DuckChessModel as model
+from .DuckChessNN import NET_PRESETS, summarize
+
+log = logging.getLogger(__name__)
+
+# Building models on the meta device and memory-mapping checkpoints need torch >= 2.1
+FAST_LOAD = tuple(int(x) for x in torch.__version__.split('+')[0].split('.')[:2]) >= (2, 1)
+_checkpointCache = {}  # stores the checkpoints loaded by NNetWrapper.fromCheckpoint, by (path, modification time)
 
 args = dotdict({
     'lr': 0.01,
@@ -20,102 +33,382 @@ args = dotdict({
     'epochs': 3,
     'batch_size': 64,
     'cuda': torch.cuda.is_available(),
+    'net': 'full',              # Network size preset from NET_PRESETS: 'tiny', 'small', 'medium' or 'full'.
+    'channels': None,           # The settings below override the preset when not None.
+    'num_blocks': None,
+    'shortcut': None,           # 'conv' (3x3 conv + BN) or 'identity' residual shortcuts.
+    'se': None,                 # Squeeze-excitation in every residual block.
+    'policy_head': None,        # 'linear', or 'conv' for the factorized convolutional head (~30K instead of ~38M parameters)
+    'train_procs': 1,           # Train data-parallel in this many CPU processes (DistributedDataParallel over gloo).
 })
 
+def netConfig():
+    """
+    Returns the model's settings: the args.net preset, overridden by those of
+    args.channels, num_blocks, shortcut, se and policy_head that are set.
+    """
+    config = dict(NET_PRESETS[args.net])
+    for key in config:
+        if args.get(key) is not None:
+            config[key] = args[key]
+    return config
+
 class NNetWrapper(NeuralNet):
-    def __init__(self, game):
-        self.model = model(game)
+    def __init__(self, game, config=None, meta=False):
+        """
+        config: the model's settings, netConfig() by default
+        meta: build the model on the meta device, without allocating or
+              initializing weights, to have them assigned afterwards
+        """
+        self.game = game
+        self.config = config or netConfig()
+        with torch.device('meta') if meta else nullcontext():
+            self.model = model(game, **self.config)
         self.input_shape = game.getBoardSize()
         self.action_size = game.getActionSize()
 
-        if args.cuda:
+        if args.cuda and not meta:
             self.model.cuda()
 
-    def train(self, examples):
+    @classmethod
+    def fromCheckpoint(cls, game, folder='checkpoint', filename='checkpoint.pth.tar'):
+        """
+        Builds a network straight from a checkpoint, for evaluation. The model
+        is constructed on the meta device and the checkpoint's tensors are
+        memory-mapped and assigned to it, so nothing is randomly initialized
+        or copied, and loading the same file again in this process reuses the
+        mapping. Networks loaded this way share their weights; train a
+        network loaded with load_checkpoint instead.
+        """
+        if not FAST_LOAD:
+            nnet = cls(game)
+            nnet.load_checkpoint(folder, filename)
+            return nnet
+        filepath = os.path.join(folder, filename)
+        writer.wait()  # the checkpoint may still be being written
+        if not os.path.exists(filepath):
+            raise Exception(f"No model in path {filepath}")
+        key = (os.path.abspath(filepath), os.path.getmtime(filepath))
+        if key not in _checkpointCache:
+            with metrics.timer('checkpoint.load'):
+                _checkpointCache[key] = torch.load(filepath, map_location='cpu', mmap=True)
+        checkpoint = _checkpointCache[key]
+        nnet = cls(game, checkpoint.get('config', NET_PRESETS['full']), meta=True)
+        nnet.model.load_state_dict(checkpoint['state_dict'], assign=True)
+        if args.cuda:
+            nnet.model.cuda()
+        return nnet
+
+    def summary(self):
+        params, macs = summarize(self.model)
+        return f"{self.config}: {params / 1e6:.2f}M parameters, {macs / 1e6:.1f}M multiply-adds per position"
+
+    def train(self, examples, epochs=None, samples=None):
         """
         examples: list of examples, each example is of form (board, pi, v)
+        epochs: overrides args.epochs when given
+        samples: if given, train on this many samples in a single pass instead
         """
+        batches = None
+        if samples is not None:
+            epochs = 1
+            batches = max(1, samples // args.batch_size)
+        if args.train_procs > 1:
+            return self.trainDistributed(examples, epochs, batches)
+
         optimizer = optim.SGD(self.model.parameters(), lr=args.lr, momentum=args.momentum)
 
-        for epoch in range(args.epochs):
+        for epoch in range(epochs or args.epochs):
             print('EPOCH ::: ' + str(epoch + 1))
             self.model.train()
             pi_losses = AverageMeter()
             v_losses = AverageMeter()
 
-            batch_count = int(len(examples) / args.batch_size)
+            batch_count = batches if batches is not None else int(len(examples) / args.batch_size)
 
             t = tqdm(range(batch_count), desc='Training Net')
             for _ in t:
-                sample_ids = np.random.randint(len(examples), size=args.batch_size)
-                boards, pis, vs = list(zip(*[examples[i] for i in sample_ids]))
-                boards = torch.FloatTensor(np.array(boards).astype(np.float64))
-                target_pis = torch.FloatTensor(np.array(pis))
-                target_vs = torch.FloatTensor(np.array(vs).astype(np.float64))
-
-                # predict
-                if args.cuda:
-                    boards, target_pis, target_vs = boards.contiguous().cuda(), target_pis.contiguous().cuda(), target_vs.contiguous().cuda()
-
-                # compute output
-                out_pi, out_v = self.model(boards)
-                l_pi = self.loss_pi(target_pis, out_pi)
-                l_v = self.loss_v(target_vs, out_v)
-                total_loss = l_pi + l_v
+                with metrics.timer('train.step'):
+                    sample_ids = np.random.randint(len(examples), size=args.batch_size)
+                    boards, pis, vs = list(zip(*[examples[i] for i in sample_ids]))
+                    boards = torch.FloatTensor(np.array(boards).astype(np.float64))
+                    target_pis = torch.FloatTensor(self.densePolicies(pis))
+                    target_vs = torch.FloatTensor(np.array(vs).astype(np.float64))
 
-                # record loss
-                pi_losses.update(l_pi.item(), boards.size(0))
-                v_losses.update(l_v.item(), boards.size(0))
-                t.set_postfix(Loss_pi=pi_losses, Loss_v=v_losses)
+                    # predict
+                    if args.cuda:
+                        boards, target_pis, target_vs = boards.contiguous().cuda(), target_pis.contiguous().cuda(), target_vs.contiguous().cuda()
 
-                # compute gradient and do SGD step
-                optimizer.zero_grad()
-                total_loss.backward()
-                optimizer.step()
+                    # compute output
+                    out_pi, out_v = self.model(boards)
+                    l_pi = self.loss_pi(target_pis, out_pi)
+                    l_v = self.loss_v(target_vs, out_v)
+                    total_loss = l_pi + l_v
+
+                    # record loss
+                    pi_losses.update(l_pi.item(), boards.size(0))
+                    v_losses.update(l_v.item(), boards.size(0))
+                    t.set_postfix(Loss_pi=pi_losses, Loss_v=v_losses)
+
+                    # compute gradient and do SGD step
+                    optimizer.zero_grad()
+                    total_loss.backward()
+                    optimizer.step()
+                metrics.incr('train.samples', boards.size(0))
 
-    def predict(self, board):
+    def trainDistributed(self, examples, epochs=None, batches=None):
         """
-        board: np array with board
+        train() on args.train_procs local CPU processes. The examples are
+        packed into shared memory once (policies as sparse rows); every epoch
+        each rank takes a disjoint shard of a shared shuffle (seeded from this
+        process's RNG, so every call shuffles differently), gradients are
+        all-reduced by DistributedDataParallel, and rank 0 writes the trained
+        weights back into this network.
+        """
+        world_size = args.train_procs
+        data = self.packExamples(examples)
+        for tensor in data.values():
+            tensor.share_memory_()
+        self.model.cpu()
+        self.model.share_memory()
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+        seed = int(torch.randint(2 ** 31, (1,)).item())
+        with metrics.timer('train.distributed'):
+            torch.multiprocessing.spawn(_trainWorker, nprocs=world_size, join=True,
+                                        args=(world_size, port, self.game, self.config, self.model, data,
+                                              epochs or args.epochs, batches, seed, dict(args)))
+        batch_count = batches if batches is not None else len(examples) // args.batch_size
+        metrics.incr('train.samples', batch_count * args.batch_size * (epochs or args.epochs))
+        if args.cuda:
+            self.model.cuda()
+
+    def packExamples(self, examples):
         """
-        # timing
-        start = time.time()
+        Converts examples into tensors: boards, outcomes, and the policies as
+        sparse rows (pi_offsets[i]:pi_offsets[i + 1] of pi_actions/pi_probs),
+        which are empty for examples without a policy target.
+        """
+        boards, pis, vs = list(zip(*examples))
+        offsets = [0]
+        actions = []
+        probs = []
+        for pi in pis:
+            if pi is not None:
+                pi = np.asarray(pi, dtype=np.float32)
+                nonzero = np.flatnonzero(pi)
+                actions.append(nonzero)
+                probs.append(pi[nonzero])
+                offsets.append(offsets[-1] + len(nonzero))
+            else:
+                offsets.append(offsets[-1])
+        return {
+            'boards': torch.FloatTensor(np.array(boards).astype(np.float32)),
+            'vs': torch.FloatTensor(np.array(vs).astype(np.float32)),
+            'pi_offsets': torch.LongTensor(offsets),
+            'pi_actions': torch.from_numpy(np.concatenate(actions) if actions else np.zeros(0, dtype=np.int64)),
+            'pi_probs': torch.from_numpy(np.concatenate(probs) if probs else np.zeros(0, dtype=np.float32)),
+        }
+
+    def unpackBatch(self, data, ids):
+        """
+        Returns the boards, dense policy targets and outcomes of the packed
+        examples ids.
+        """
+        target_pis = torch.zeros(len(ids), self.action_size)
+        offsets = data['pi_offsets']
+        for row, i in enumerate(ids.tolist()):
+            start, end = offsets[i], offsets[i + 1]
+            target_pis[row, data['pi_actions'][start:end]] = data['pi_probs'][start:end]
+        return data['boards'][ids], target_pis, data['vs'][ids]
+
+    def distill(self, teacher, examples, epochs=None, outcome_weight=0.0):
+        """
+        Trains this network to mimic teacher (another NNetWrapper, usually a
+        bigger one) on the boards of examples.
+
+        teacher: network whose policy and value are the targets
+        examples: list of examples of form (board, pi, v); only the boards are
+                  used, plus v when outcome_weight > 0
+        epochs: overrides args.epochs when given
+        outcome_weight: weight of the game outcome v in the value target,
+                        against 1 - outcome_weight for the teacher's value
+        """
+        optimizer = optim.SGD(self.model.parameters(), lr=args.lr, momentum=args.momentum)
+        teacher.model.eval()
 
+        for epoch in range(epochs or args.epochs):
+            print('EPOCH ::: ' + str(epoch + 1))
+            self.model.train()
+            pi_losses = AverageMeter()
+            v_losses = AverageMeter()
+
+            batch_count = int(len(examples) / args.batch_size)
+
+            t = tqdm(range(batch_count), desc='Distilling Net')
+            for _ in t:
+                with metrics.timer('distill.step'):
+                    sample_ids = np.random.randint(len(examples), size=args.batch_size)
+                    boards, _, vs = list(zip(*[examples[i] for i in sample_ids]))
+                    boards = torch.FloatTensor(np.array(boards).astype(np.float64))
+                    outcomes = torch.FloatTensor(np.array(vs).astype(np.float64))
+                    if args.cuda:
+                        boards, outcomes = boards.contiguous().cuda(), outcomes.contiguous().cuda()
+
+                    with torch.no_grad():
+                        teacher_pi, teacher_v = teacher.model(boards)
+                    target_pis = torch.exp(teacher_pi)
+                    target_vs = (1 - outcome_weight) * teacher_v.view(-1) + outcome_weight * outcomes
+
+                    out_pi, out_v = self.model(boards)
+                    l_pi = self.loss_pi(target_pis, out_pi)
+                    l_v = self.loss_v(target_vs, out_v)
+                    total_loss = l_pi + l_v
+
+                    pi_losses.update(l_pi.item(), boards.size(0))
+                    v_losses.update(l_v.item(), boards.size(0))
+                    t.set_postfix(Loss_pi=pi_losses, Loss_v=v_losses)
+
+                    optimizer.zero_grad()
+                    total_loss.backward()
+                    optimizer.step()
+
+    def predict(self, board, actions=None):
+        """
+        board: np array with board
+        actions: optional flat action indices; only their probabilities are
+                 computed, normalized over them
+        """
         # Go from the human-readable DuckChessBoard format 
         # to the 16x8x8 binary planes encoded input shape
-        encoded = board.encode()
+        with metrics.timer('nnet.encode'):
+            encoded = board.encode()
         # preparing input
         s = torch.FloatTensor(encoded.astype(np.float64))
         if args.cuda: s = s.contiguous().cuda()
         s = s.view(1, *self.input_shape)
+        if actions is not None:
+            actions = torch.as_tensor(actions, dtype=torch.long, device=s.device)
         self.model.eval()
-        with torch.no_grad():
-            pi, v = self.model(s)
+        with metrics.timer('nnet.forward'), torch.no_grad():
+            pi, v = self.model(s, actions)
 
-        # print('PREDICTION TIME TAKEN : {0:03f}'.format(time.time()-start))
         return torch.exp(pi).data.cpu().numpy()[0], v.data.cpu().numpy()[0]
 
+    def densePolicies(self, pis):
+        """
+        Stacks policy targets into a batch. Examples without a policy target
+        (pi is None, see Coach playout cap randomization) get an all-zero row,
+        which contributes nothing to loss_pi.
+        """
+        dense = np.zeros((len(pis), self.action_size), dtype=np.float32)
+        for i, pi in enumerate(pis):
+            if pi is not None:
+                dense[i] = pi
+        return dense
+
     def loss_pi(self, targets, outputs):
-        return -torch.sum(targets * outputs) / targets.size()[0]
+        # only average over the examples that carry a policy target
+        num_targets = max(int((targets.sum(dim=1) > 0).sum()), 1)
+        return -torch.sum(targets * outputs) / num_targets
 
     def loss_v(self, targets, outputs):
         return torch.sum((targets - outputs.view(-1)) ** 2) / targets.size()[0]
 
     def save_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
+        """
+        Snapshots the weights to CPU memory and writes them in the background
+        (see utils.BackgroundWriter), atomically. Returns the write's Future;
+        load_checkpoint waits for pending writes by itself.
+        """
         filepath = os.path.join(folder, filename)
         if not os.path.exists(folder):
             print("Checkpoint Directory does not exist! Making directory {}".format(folder))
             os.mkdir(folder)
         else:
             print("Checkpoint Directory exists! ")
-        torch.save({
-            'state_dict': self.model.state_dict(),
-        }, filepath)
+        with metrics.timer('checkpoint.save'):
+            checkpoint = {
+                'state_dict': {k: v.detach().cpu().clone() for k, v in self.model.state_dict().items()},
+                'config': dict(self.config),
+            }
+
+        def write(path):
+            with metrics.timer('checkpoint.write'):
+                torch.save(checkpoint, path)
+        return writer.submit(filepath, write)
 
     def load_checkpoint(self, folder='checkpoint', filename='checkpoint.pth.tar'):
         # https://github.com/pytorch/examples/blob/master/imagenet/main.py#L98
         filepath = os.path.join(folder, filename)
+        writer.wait()  # the checkpoint may still be being written
         if not os.path.exists(filepath):
             raise Exception(f"No model in path {filepath}")
         map_location = None if args.cuda else 'cpu'
         checkpoint = torch.load(filepath, map_location=map_location)
+        # checkpoints from before the network was configurable are all 'full'
+        config = checkpoint.get('config', NET_PRESETS['full'])
+        if config != self.config:
+            log.info(f"Rebuilding the network for the checkpoint's settings {config}")
+            self.config = config
+            self.model = model(self.game, **config)
+            if args.cuda:
+                self.model.cuda()
         self.model.load_state_dict(checkpoint['state_dict'])
+
+def _trainWorker(rank, world_size, port, game, config, shared_model, data, epochs, batches, seed, parent_args):
+    # One rank of NNetWrapper.trainDistributed, started by torch.multiprocessing.spawn
+    args.update(parent_args)
+    args.cuda = False
+    os.environ['MASTER_ADDR'] = '127.0.0.1'
+    os.environ['MASTER_PORT'] = str(port)
+    dist.init_process_group('gloo', rank=rank, world_size=world_size)
+    torch.set_num_threads(max(1, (os.cpu_count() or 1) // world_size))
+    try:
+        nnet = NNetWrapper(game, config)
+        nnet.model.load_state_dict(shared_model.state_dict())
+        model = DistributedDataParallel(nnet.model)
+        optimizer = optim.SGD(model.parameters(), lr=args.lr, momentum=args.momentum)
+
+        # every rank runs the same number of steps, each on its share of the batch
+        batch_size = max(1, args.batch_size // world_size)
+        num_examples = len(data['vs'])
+        batch_count = batches if batches is not None else num_examples // (batch_size * world_size)
+        for epoch in range(epochs):
+            if rank == 0:
+                print('EPOCH ::: ' + str(epoch + 1))
+            model.train()
+            pi_losses = AverageMeter()
+            v_losses = AverageMeter()
+            # the same shuffle on every rank, of which each takes a disjoint shard
+            generator = torch.Generator().manual_seed(seed + epoch)
+            order = torch.randperm(num_examples, generator=generator)[rank::world_size]
+            if batch_count * batch_size > len(order):
+                # more batches than one pass over the shard, as the continuous pipeline may ask for
+                order = order[torch.randint(len(order), (batch_count * batch_size,), generator=generator)]
+
+            t = tqdm(range(batch_count), desc='Training Net', disable=rank != 0)
+            for i in t:
+                boards, target_pis, target_vs = nnet.unpackBatch(data, order[i * batch_size:(i + 1) * batch_size])
+
+                out_pi, out_v = model(boards)
+                l_pi = nnet.loss_pi(target_pis, out_pi)
+                l_v = nnet.loss_v(target_vs, out_v)
+                total_loss = l_pi + l_v
+
+                pi_losses.update(l_pi.item(), boards.size(0))
+                v_losses.update(l_v.item(), boards.size(0))
+                t.set_postfix(Loss_pi=pi_losses, Loss_v=v_losses)
+
+                optimizer.zero_grad()
+                total_loss.backward()
+                optimizer.step()
+
+        if rank == 0:
+            with torch.no_grad():
+                trained = nnet.model.state_dict()
+                for name, tensor in shared_model.state_dict().items():
+                    tensor.copy_(trained[name])
+    finally:
+        dist.destroy_process_group()
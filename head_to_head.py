@@ -26,21 +26,19 @@ def main():
     )
     parser.add_argument('model1_dir', help="Directory with the saved model, for model 1")
     parser.add_argument('model1_name', help="Name of the file for model 1, e.g. 'checkpoint_0.pth.tar'")
-    parser.add_argument('model2dir', help="Directory with the saved model, for model 2")
-    parser.add_argument('model2name', help="Name of the file for model 2, e.g. 'checkpoint_5.pth.tar'")    
+    parser.add_argument('model2_dir', help="Directory with the saved model, for model 2")
+    parser.add_argument('model2_name', help="Name of the file for model 2, e.g. 'checkpoint_5.pth.tar'")
     args = parser.parse_args()
 
     g = DuckChessGame()
 
-    n1 = nn(g)
-    n2 = nn(g)
-    n1.load_checkpoint(folder=args.model1_dir, filename=args.model1_name)
-    n2.load_checkpoint(folder=args.model2_dir, filename=args.model2_name)
+    n1 = nn.fromCheckpoint(g, folder=args.model1_dir, filename=args.model1_name)
+    n2 = nn.fromCheckpoint(g, folder=args.model2_dir, filename=args.model2_name)
 
-    args1 = dotdict({'numMCTSSims': 20, 'cpuct':1.0, 'verbose': False})
-    args2 = args1
+    args1 = dotdict({'numMCTSSims': 20, 'cpuct':1.0, 'solver': True, 'smartStop': True, 'verbose': False})
+    args2 = dotdict(args1)
     mcts1 = MCTS(g, n1, args1)
-    mcts2 = MCTS(g, n1, args2)
+    mcts2 = MCTS(g, n2, args2)
     n1p = lambda x: np.argmax(mcts1.getActionProb(x, temp=0))
     n2p = lambda x: np.argmax(mcts2.getActionProb(x, temp=0))
 
@@ -1,5 +1,6 @@
 import Arena
 from MCTS import MCTS
+from ParallelMCTS import RootParallelMCTS, ThreadedMCTS
 
 from duckchess.DuckChessGame import DuckChessGame
 from duckchess.DuckChessNetWrapper import NNetWrapper as nn
@@ -23,24 +24,38 @@ def main():
     )
     parser.add_argument('model_dir', help="Directory with the saved model")
     parser.add_argument('model_name', help="Name of the file, e.g. 'checkpoint_5.pth.tar'")
+    parser.add_argument('--stats', action='store_true', help="Log the AI's search statistics after each of its moves")
+    parser.add_argument('--time', type=float, default=None, help="Maximum seconds the AI may search per move")
+    parser.add_argument('--threads', type=int, default=1, help="Number of threads searching the AI's tree in parallel")
+    parser.add_argument('--processes', type=int, default=1, help="Number of processes searching the AI's move root-parallel")
+    parser.add_argument('--duck-candidates', type=int, default=None, help="Only search relevant duck squares plus the N most probable per chess move")
     args = parser.parse_args()
 
     g = DuckChessGame()
 
     player2 = hp = HumanDuckChessPlayer(g).play
 
-    n1 = nn(g)
-    n1.load_checkpoint(folder=args.model_dir, filename=args.model_name)
+    n1 = nn.fromCheckpoint(g, folder=args.model_dir, filename=args.model_name)
 
-    args1 = dotdict({'numMCTSSims': 60, 'cpuct':1.0, 'verbose': True})
-    mcts1 = MCTS(g, n1, args1)
+    args1 = dotdict({'numMCTSSims': 60, 'cpuct':1.0, 'solver': True, 'smartStop': True, 'searchTimeLimit': args.time, 'duckCandidates': args.duck_candidates, 'numThreads': args.threads, 'numProcesses': args.processes, 'verbose': True})
+    if args.processes > 1:
+        mcts1 = RootParallelMCTS(g, n1, args1)
+    elif args.threads > 1:
+        mcts1 = ThreadedMCTS(g, n1, args1)
+    else:
+        mcts1 = MCTS(g, n1, args1)
     n1p = lambda x: np.argmax(mcts1.getActionProb(x, temp=0))
 
 
     # The interface is much easier if the human is white
-    arena = Arena.Arena(player2, n1p, g, display=(lambda x: x))
+    searchStats = {'ai': mcts1} if args.stats else None
+    arena = Arena.Arena(player2, n1p, g, display=(lambda x: x), searchStats=searchStats, statsPerMove=True)
     print("You are playing as white")
-    print(arena.playGame(verbose=True))
+    try:
+        print(arena.playGame(verbose=True))
+    finally:
+        if args.processes > 1 or args.threads > 1:
+            mcts1.close()  # stops the worker processes or the thread pool
 
 if __name__ == "__main__":
     main()
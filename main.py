@@ -1,3 +1,4 @@
+import argparse
 import logging
 
 import coloredlogs
@@ -5,6 +6,7 @@ import coloredlogs
 from Coach import Coach
 from duckchess.DuckChessGame import DuckChessGame
 from duckchess.DuckChessNetWrapper import NNetWrapper as nn
+from duckchess.DuckChessNetWrapper import args as nnet_args
 from utils import *
 
 # Debug, trying to reproduce a specific error
@@ -35,21 +37,75 @@ args = dotdict({
     'numMCTSSims': 30,          # Number of games moves for MCTS to simulate.
     'arenaCompare': 0,         # Number of games to play during arena play to determine if new net will be accepted.
     'cpuct': 1,
+    'solver': False,            # Prove wins/losses (king captures) in the tree and play proven wins immediately.
+    'smartStop': False,         # At temp=0, stop searching once the best move can no longer change.
+    'gumbel': False,            # Use Gumbel sequential halving at the root, and train on its improved policy.
+    'gumbelK': 16,              # With gumbel, number of root moves sampled for sequential halving.
+    'gumbelCVisit': 50,         # With gumbel, constants of the sigma(q) transform.
+    'gumbelCScale': 1.0,
+    'expandTopK': None,         # Search only the k most probable valid moves of each node (None = all).
+    'expandMass': None,         # Search only the most probable valid moves covering this much prior mass (None = all).
+    'expandWiden': None,        # Keep the pruned moves and add expandWiden * sqrt(N(s)) of them back as visits grow.
+    'duckCandidates': None,     # In arena play, search only relevant duck squares plus the top N by prior per chess move.
+    'legalOnlyEval': False,     # Have the network compute the priors of the valid moves only.
+    'selfPlayWorkers': 0,       # Play the self-play games on this many worker processes sharing the network's weights.
+    'coordinatorPort': None,    # Serve self-play games to remote workers (selfplay_worker.py) on this TCP port.
+    'coordinatorHost': '127.0.0.1',     # Interface the coordinator listens on; any other than loopback needs a token.
+    'coordinatorToken': None,   # Shared secret remote workers must present (selfplay_worker.py --token).
+    'heartbeatInterval': 5,     # Seconds between the heartbeats of a remote worker playing a game.
+    'heartbeatTimeout': 60,     # Seconds of silence after which a remote worker's game is reassigned.
+    'remoteWaitTimeout': 600,   # Seconds without a finished remote game before playing the rest locally (None = wait forever).
+    'numProcesses': 1,          # Arena games search root-parallel in this many worker processes.
+    'rootNoise': None,          # Dirichlet alpha of noise on root priors (root-parallel workers default to 0.3).
+    'openingPlies': 0,          # Share the search of the first plies between the self-play games of a network (0 = off). Per worker process: each self-play worker keeps its own cache.
+    'openingFreshSims': 5,      # New simulations per move for an opening position that is already searched.
+    'recordGames': False,       # Save self-play games as compact GameRecords (moves + top policy entries), not boards. Lossy: resumed policies keep only recordTopK entries, as float16.
+    'recordTopK': 16,           # Policy entries kept per move in a GameRecord (None = all nonzero).
+    'trainEvery': 2048,         # With --continuous, train a round whenever this many new examples have arrived.
+    'sampleReuse': 4,           # With --continuous, training samples drawn per new example (the sample/replay ratio).
+    'checkpointEvery': 10,      # With --continuous, keep a numbered checkpoint every this many rounds.
+    'shardGames': 1,            # With --continuous, games per shard written by each self-play producer.
+    'playoutCapRandomization': False,   # Only search (and record a policy target for) some moves fully.
+    'fullSearchProb': 0.25,     # With playoutCapRandomization, the fraction of moves that get the full numMCTSSims.
+    'numMCTSSimsFast': 6,       # With playoutCapRandomization, simulations for the other moves.
+    'resignThreshold': None,    # Resign when the root value stays below this (e.g. -0.9). None disables resignation.
+    'resignConsecutive': 3,     # Number of consecutive own moves below resignThreshold before resigning.
+    'resignPlayoutFraction': 0.1,   # Fraction of games played out without resigning, to measure false resignations.
 
     'checkpoint': './temp/duckchessv0/',
     'load_model': True,
     'load_folder_file': ('./temp/duckchessv0/','checkpoint_1.pth.tar'),
     'starting_iteration': 2,    # Set to higher than 1 if resuming from a checkpoint
     'numItersForTrainExamplesHistory': 2,
-    'verbose': False
+    'verbose': False,
+    'metricsFormat': None,      # Per-iteration timing file in the checkpoint folder: 'json' or 'prometheus' (None = off).
+    'searchStatsLog': None,     # Log MCTS.stats() per 'game' or per 'move' (None = off).
 })
 
 
 def main():
+    parser = argparse.ArgumentParser(
+        prog='main.py',
+        description='Train a Duck Chess model through self-play'
+    )
+    parser.add_argument('--profile', type=int, default=0, metavar='N',
+                        help="Instead of training, profile N self-play episodes and one training epoch. "
+                             "Profiles are written to the checkpoint folder.")
+    parser.add_argument('--profile-phases', default='selfplay,train',
+                        help="Comma separated phases to profile: selfplay, train")
+    parser.add_argument('--net', default=None,
+                        help="Network size preset for a new model: tiny, small, medium or full (the default)")
+    parser.add_argument('--continuous', action='store_true',
+                        help="Run self-play producers and training concurrently, exchanging games through shard "
+                             "files and models through the latest checkpoint")
+    cli = parser.parse_args()
+
     log.info('Loading %s...', DuckChessGame.__name__)
     game = DuckChessGame()
 
     log.info('Loading %s...', nn.__name__)
+    if cli.net:
+        nnet_args.net = cli.net
     nnet = nn(game)
 
     if args.load_model:
@@ -57,6 +113,7 @@ def main():
         nnet.load_checkpoint(args.load_folder_file[0], args.load_folder_file[1])
     else:
         log.warning('Not loading a checkpoint!')
+    log.info('Network: %s', nnet.summary())
 
     log.info('Loading the Coach...')
     c = Coach(game, nnet, args)
@@ -65,8 +122,16 @@ def main():
         log.info("Loading 'trainExamples' from file...")
         c.loadTrainExamples()
 
+    if cli.profile:
+        log.info(f'Profiling {cli.profile} episodes ({cli.profile_phases})')
+        c.profile(cli.profile, phases=cli.profile_phases.split(','))
+        return
+
     log.info('Starting the learning process 🎉')
-    c.learn()
+    if cli.continuous:
+        c.learnContinuous()
+    else:
+        c.learn()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,36 @@
+from Coach import Coach
+from RemoteSelfPlay import Worker
+from duckchess.DuckChessGame import DuckChessGame
+from duckchess.DuckChessNetWrapper import NNetWrapper as nn
+
+import argparse
+import os
+
+import logging
+import coloredlogs
+
+log = logging.getLogger(__name__)
+coloredlogs.install(level='INFO')
+
+"""
+Play self-play games for a training run on another machine, see RemoteSelfPlay
+"""
+def main():
+    parser = argparse.ArgumentParser(
+        prog='selfplay_worker.py',
+        description="Play self-play games for a coordinator started by main.py with args.coordinatorPort"
+    )
+    parser.add_argument('host', help="Host of the coordinator")
+    parser.add_argument('port', type=int, help="Port of the coordinator (args.coordinatorPort)")
+    parser.add_argument('--token', default=os.environ.get('SELFPLAY_TOKEN'),
+                        help="Token of the coordinator (args.coordinatorToken, default: $SELFPLAY_TOKEN)")
+    parser.add_argument('--name', default=None, help="Name of this worker in the coordinator's log (default: host-pid)")
+    args = parser.parse_args()
+
+    g = DuckChessGame()
+    worker = Worker(args.host, args.port, name=args.name, token=args.token)
+    log.info(f"Connecting to {args.host}:{args.port} as {worker.name}")
+    worker.run(lambda coachArgs: Coach(g, nn(g), coachArgs))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the modules live at the top of the repository, next to main.py
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
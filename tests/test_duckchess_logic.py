@@ -0,0 +1,44 @@
+import numpy as np
+
+from duckchess.DuckChessGame import DuckChessGame
+
+
+def findAction(game, board, origin, destination, duck):
+    # the valid action moving the piece on origin to destination and the duck to duck,
+    # all (rank, file) from the perspective of the player to move
+    for action in np.flatnonzero(game.getValidMoves(board, 1)):
+        rank, file, moveType, duckRank, duckFile = board.decodeAction(action)
+        rankOffset, fileOffset = board.decodeChessMove(moveType)
+        if ((rank, file), (rank + rankOffset, file + fileOffset), (duckRank, duckFile)) == (origin, destination, duck):
+            return action
+    raise ValueError(f"No valid move {origin} -> {destination} with the duck on {duck}")
+
+
+def test_threefold_repetition_is_a_draw():
+    game = DuckChessGame()
+    board = game.getInitBoard()
+    player = 1
+    # both sides move a knight out and back, each putting the duck on its
+    # fifth rank, so the position after the first move comes back every four
+    # plies; the ninth ply makes it the third occurrence
+    cycle = (((7, 6), (5, 5)), ((7, 6), (5, 5)), ((5, 5), (7, 6)), ((5, 5), (7, 6)))
+    results = []
+    for ply in range(9):
+        origin, destination = cycle[ply % 4]
+        action = findAction(game, board, origin, destination, (4, 0))
+        board, player = game.getNextState(board, player, action)
+        results.append(game.getGameEnded(board, player))
+
+    assert results == [0] * 8 + [0.1]
+
+def test_incremental_zobrist_matches_recomputed():
+    game = DuckChessGame()
+    board = game.getInitBoard()
+    player = 1
+    rng = np.random.default_rng(0)
+    for _ in range(60):
+        action = rng.choice(np.flatnonzero(game.getValidMoves(board, 1)))
+        board, player = game.getNextState(board, player, action)
+        assert board.zobrist == board.computeZobrist()
+        if game.getGameEnded(board, player) != 0:
+            break
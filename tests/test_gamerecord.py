@@ -0,0 +1,58 @@
+import numpy as np
+
+from GameRecord import GameRecord
+from duckchess.DuckChessGame import DuckChessGame
+
+
+def playRandomGame(game, plies, rng):
+    # Returns: the GameRecord of a random game and the encoded board of every ply
+    board = game.getInitBoard()
+    player = 1
+    record = GameRecord()
+    boards = []
+    for ply in range(plies):
+        valids = np.flatnonzero(game.getValidMoves(board, 1))
+        pi = np.zeros(game.getActionSize(), dtype=np.float32)
+        pi[valids] = rng.random(len(valids))
+        pi /= pi.sum()
+        action = rng.choice(valids)
+        boards.append(board.encode())
+        record.add(action, pi if ply % 3 else None, topK=8)
+        board, player = game.getNextState(board, player, action)
+        if game.getGameEnded(board, player) != 0:
+            break
+    record.result = -1.0
+    return record, boards
+
+
+def test_bytes_round_trip():
+    record, _ = playRandomGame(DuckChessGame(), 20, np.random.default_rng(0))
+
+    decoded = GameRecord.fromBytes(record.toBytes())
+
+    assert decoded.actions == record.actions
+    assert decoded.result == record.result
+    assert len(decoded.policies) == len(record.policies)
+    for policy, expected in zip(decoded.policies, record.policies):
+        if expected is None:
+            assert policy is None
+        else:
+            assert np.array_equal(policy[0], expected[0])
+            assert np.array_equal(policy[1], expected[1])
+
+
+def test_examples_replay_the_game():
+    game = DuckChessGame()
+    record, boards = playRandomGame(game, 20, np.random.default_rng(1))
+
+    examples = GameRecord.fromBytes(record.toBytes()).examples(game)
+
+    assert len(examples) == len(boards)
+    for ply, ((board, pi, v), expected) in enumerate(zip(examples, boards)):
+        assert np.array_equal(board, expected)
+        assert v == record.result * (1 if ply % 2 == 0 else -1)
+        if record.policies[ply] is None:
+            assert pi is None
+        else:
+            assert np.count_nonzero(pi) == len(record.policies[ply][0])
+            assert abs(pi.sum() - 1) < 1e-5
@@ -0,0 +1,24 @@
+import numpy as np
+
+from MCTS import MCTS
+from duckchess.DuckChessGame import DuckChessGame
+from duckchess.DuckChessLogic import Pieces
+from duckchess.DuckChessNetWrapper import NNetWrapper, args as nnetArgs
+from utils import dotdict
+
+
+def test_solver_plays_king_capture():
+    game = DuckChessGame()
+    board = game.getInitBoard()
+    board.pieces[1][4] = Pieces.PLAYER_Q  # next to the opponent's king
+    board.zobrist = board.computeZobrist()
+    board.history = [board.positionKey()]
+    nnetArgs.net = 'tiny'
+    mcts = MCTS(game, NNetWrapper(game), dotdict({'numMCTSSims': 10, 'cpuct': 1, 'solver': True}))
+
+    probs = np.array(mcts.getActionProb(board, temp=1))
+
+    assert np.count_nonzero(probs) == 1
+    assert probs.sum() == 1
+    winningMoves = game.getWinningMoves(board, game.getValidMoves(board, 1))
+    assert np.argmax(probs) in winningMoves
@@ -1,3 +1,11 @@
+import logging
+import os
+
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger(__name__)
+
+
 class AverageMeter(object):
     """From https://github.com/pytorch/examples/blob/master/imagenet/main.py"""
 
@@ -20,3 +28,59 @@ class AverageMeter(object):
 class dotdict(dict):
     def __getattr__(self, name):
         return self[name]
+
+
+def atomicWrite(filepath, write):
+    """
+    Calls write(path) with a temporary path next to filepath, syncs it to disk
+    and renames it to filepath, so that filepath is either the old file or
+    the complete new one, never a partial write. The directory is synced too,
+    so the rename itself survives a crash.
+    """
+    tmp = f"{filepath}.tmp{os.getpid()}"
+    try:
+        write(tmp)
+        with open(tmp, 'rb+') as f:
+            os.fsync(f.fileno())
+        os.replace(tmp, filepath)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    if os.name == 'posix':  # directories can't be opened for syncing on Windows
+        fd = os.open(os.path.dirname(os.path.abspath(filepath)), os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class BackgroundWriter():
+    """
+    Runs atomicWrite()s on one background thread, in submission order, so
+    callers don't wait on disk I/O. submit() returns a Future; wait() blocks
+    until everything submitted so far is on disk and re-raises any error.
+
+    A failed write is logged as soon as it fails, and raised by the next
+    submit() or wait(): submit() first waits for the previous write, so at
+    most one write is in flight and a failure is never silently dropped.
+    """
+
+    def __init__(self):
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='writer')
+        self.pending = []
+
+    def submit(self, filepath, write):
+        self.wait()
+        future = self.executor.submit(atomicWrite, filepath, write)
+        future.add_done_callback(lambda f: f.exception() and log.error(f"Writing {filepath} failed: {f.exception()!r}"))
+        self.pending.append(future)
+        return future
+
+    def wait(self):
+        pending, self.pending = self.pending, []
+        for future in pending:
+            future.result()
+
+
+writer = BackgroundWriter()